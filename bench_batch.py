@@ -0,0 +1,61 @@
+# bench_batch.py
+# Sweeps DetectWorker's forward pass over a range of batch sizes so you can pick DETECT_BATCH_SIZE for your box.
+# Throughput is frames/sec of pure forward time. Latency is what the last frame of a full batch would see:
+# the time to fill the batch at the given camera fps plus the forward pass itself.
+
+import argparse
+import time
+import cv2
+import numpy as np
+
+import config
+import dnn_backend
+
+
+def load_net():
+    net = cv2.dnn.readNetFromDarknet(config.DETECT_CFG_PATH, config.DETECT_WEIGHTS_PATH)
+    dnn_backend.configure_net(net)
+    layer_names = net.getLayerNames()
+    output_layers = [layer_names[i - 1] for i in net.getUnconnectedOutLayers()]
+    return net, output_layers
+
+
+def bench_batch_size(net, output_layers, frames, batch_size, iterations):
+    batch = [frames[i % len(frames)] for i in range(batch_size)]
+    # One warm-up pass so layer allocation doesn't count against the first size.
+    blob = cv2.dnn.blobFromImages(batch, 1/255.0, (config.DETECT_INPUT_SIZE, config.DETECT_INPUT_SIZE), swapRB=True, crop=False)
+    net.setInput(blob)
+    net.forward(output_layers)
+
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        blob = cv2.dnn.blobFromImages(batch, 1/255.0, (config.DETECT_INPUT_SIZE, config.DETECT_INPUT_SIZE), swapRB=True, crop=False)
+        net.setInput(blob)
+        net.forward(output_layers)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched detection forward passes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 4, 8], help="Batch sizes to try")
+    parser.add_argument("--iterations", type=int, default=10, help="Timed passes per batch size")
+    parser.add_argument("--fps", type=float, default=30.0, help="Camera frame rate used to estimate batch fill time")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    args = parser.parse_args()
+
+    net, output_layers = load_net()
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (args.height, args.width, 3), dtype=np.uint8) for _ in range(4)]
+
+    print(f"{'batch':>5} {'pass ms':>9} {'fps':>8} {'latency ms':>11}")
+    for size in args.sizes:
+        pass_time = bench_batch_size(net, output_layers, frames, size, args.iterations)
+        fill_time = (size - 1) / args.fps
+        print(f"{size:>5} {1000 * pass_time:>9.1f} {size / pass_time:>8.1f} {1000 * (fill_time + pass_time):>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# bench_decode.py
+# Microbenchmark of the vectorized yolo_decode path against the per-row Python loop the workers used to run.
+# Uses synthetic output layers shaped like people-r-people's two YOLO heads at the chosen input size,
+# so it doesn't need the weights file.
+
+import argparse
+import time
+import numpy as np
+
+import yolo_decode
+
+
+def legacy_decode(outputs, width, height, confidence_threshold=0.5, face_class_id=1):
+    # The old double loop from DetectWorker.process_frame / FacePackager.run, minus the cropping.
+    boxes = []
+    confidences = []
+    for output in outputs:
+        for detection in output:
+            scores = detection[5:]
+            class_id = int(np.argmax(scores))
+            confidence = scores[class_id]
+            if confidence < confidence_threshold or class_id != face_class_id:
+                continue
+            center_x = int(detection[0] * width)
+            center_y = int(detection[1] * height)
+            w = int(detection[2] * width)
+            h = int(detection[3] * height)
+            x = max(0, int(center_x - w / 2))
+            y = max(0, int(center_y - h / 2))
+            w = min(w, width - x)
+            h = min(h, height - y)
+            boxes.append([x, y, w, h])
+            confidences.append(float(confidence))
+    return boxes, confidences
+
+
+def synthetic_outputs(input_size, rng, hit_rate=0.01):
+    # Two heads at stride 32 and 16 with 3 anchors each, 2 classes -> 7 columns per row.
+    outputs = []
+    for stride in (32, 16):
+        cells = (input_size // stride) ** 2 * 3
+        output = rng.random((cells, 7), dtype=np.float32) * 0.2
+        output[:, 2:4] *= 0.5
+        hits = rng.random(cells) < hit_rate
+        output[hits, 6] = 0.9
+        outputs.append(output)
+    return outputs
+
+
+def time_it(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vectorized YOLO decoding against the per-row loop")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[416, 608, 832], help="Network input sizes to simulate")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    width, height = 1280, 720
+    print(f"{'input':>6} {'rows':>6} {'loop ms':>9} {'numpy ms':>9} {'speedup':>8}")
+    for size in args.sizes:
+        outputs = synthetic_outputs(size, rng)
+        rows = sum(len(output) for output in outputs)
+
+        # The loop let zero-size boxes through and relied on the crop.size check to skip them later.
+        old_boxes, _ = legacy_decode(outputs, width, height)
+        old_boxes = [box for box in old_boxes if box[2] > 0 and box[3] > 0]
+        new_boxes, _, _ = yolo_decode.decode_detections(outputs, width, height, 0.5, class_id=1)
+        assert sorted(map(tuple, old_boxes)) == sorted(map(tuple, new_boxes.tolist())), "decoders disagree"
+
+        loop = time_it(lambda: legacy_decode(outputs, width, height), args.repeat)
+        vectorized = time_it(lambda: yolo_decode.decode_detections(outputs, width, height, 0.5, class_id=1), args.repeat)
+        print(f"{size:>6} {rows:>6} {1000 * loop:>9.2f} {1000 * vectorized:>9.2f} {loop / vectorized:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# benchmark.py
+# End-to-end pipeline benchmark (producer -> detect -> face) on a video file or synthetic frames instead of a webcam.
+# Prints a summary and writes a JSON report; --compare checks it against an earlier report and exits non-zero if
+# throughput or latency regressed by more than --tolerance.
+
+import argparse
+import json
+import sys
+import threading
+import time
+import platform
+from queue import Queue
+import numpy as np
+
+import config
+from frame_queue import LatestQueue
+from frame_source import VideoFileSource, SyntheticSource
+from producer import FrameProducer
+from workers import DetectWorker, FaceWorker
+
+
+class _CpuTimed:
+    # Mixed into each stage so we get the CPU time its thread burned (thread_time only works from inside the thread).
+    cpu_time = 0.0
+
+    def run(self):
+        super().run()
+        self.cpu_time = time.thread_time()
+
+
+class BenchProducer(_CpuTimed, FrameProducer):
+    pass
+
+
+class BenchDetectWorker(_CpuTimed, DetectWorker):
+    def __init__(self, *args, **kwargs):
+        self.latencies = []
+        super().__init__(*args, **kwargs)
+
+    def handle_boxes(self, payload, frame, boxes):
+        super().handle_boxes(payload, frame, boxes)
+        self.latencies.append(time.time() - payload["timestamp"])
+
+
+class BenchFaceWorker(_CpuTimed, FaceWorker):
+    def __init__(self, *args, **kwargs):
+        self.latencies = []
+        super().__init__(*args, **kwargs)
+
+    def process_batch(self, payloads):
+        super().process_batch(payloads)
+        done = time.time()
+        self.latencies.extend(done - payload["timestamp"] for payload in payloads)
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "mean": None}
+    ms = 1000 * np.asarray(values)
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"count": len(values), "p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(ms.mean())}
+
+
+def make_source(args):
+    if args.source == "synthetic":
+        return SyntheticSource(args.width, args.height, fps=args.fps, realtime=args.realtime,
+                               num_frames=args.frames, faces_dir=config.OUTPUT_DIR)
+    return VideoFileSource(args.source, realtime=args.realtime)
+
+
+def run_benchmark(args):
+    source = make_source(args)
+    stop_event = threading.Event()
+    detect_queue = LatestQueue(maxsize=config.DETECT_QUEUE_SIZE, name="detect")
+    face_queue = Queue(maxsize=config.FACE_QUEUE_SIZE)
+
+    producer = BenchProducer(source, [detect_queue], stop_event)
+    detect_worker = BenchDetectWorker(detect_queue, stop_event, face_output_queue=face_queue,
+                                      batch_size=args.batch_size, cascade=args.cascade or None)
+    face_worker = BenchFaceWorker(face_queue, stop_event)
+    stages = {"producer": producer, "detect": detect_worker, "face": face_worker}
+
+    start = time.time()
+    for t in stages.values():
+        t.start()
+
+    # Run until the source runs out (or the time limit), then give the workers a moment to drain what's queued.
+    deadline = start + args.duration if args.duration else None
+    while producer.is_alive() and (deadline is None or time.time() < deadline):
+        time.sleep(0.1)
+    drain_until = time.time() + 2.0
+    while (detect_queue.qsize() or face_queue.qsize()) and time.time() < drain_until:
+        time.sleep(0.05)
+    stop_event.set()
+    for t in stages.values():
+        t.join()
+    wall = time.time() - start
+
+    producer_stats = producer.stats()
+    detect_stats = producer_stats["consumers"]["detect"]
+    frames_detected = len(detect_worker.latencies)
+    faces_total = detect_worker.faces_emitted + detect_worker.faces_dropped
+    return {
+        "source": args.source,
+        "realtime": args.realtime,
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "processor": platform.processor()},
+        "config": {
+            "detect_batch_size": detect_worker.batch_size,
+            "detect_cascade": detect_worker.cascade,
+            "detect_queue_size": config.DETECT_QUEUE_SIZE,
+            "face_queue_size": config.FACE_QUEUE_SIZE,
+            "frame_sampling": config.FRAME_SAMPLING,
+            "frame_interval": config.FRAME_INTERVAL,
+        },
+        "wall_seconds": wall,
+        "frames_captured": source.stats()["captured"],
+        "frames_produced": producer_stats["produced"],
+        "frames_detected": frames_detected,
+        "fps": frames_detected / wall if wall > 0 else 0.0,
+        "latency_ms": {
+            "frame_to_detection": percentiles(detect_worker.latencies),
+            "frame_to_recognition": percentiles(face_worker.latencies),
+        },
+        "drops": {
+            "detect_queue": detect_stats["dropped"],
+            "detect_queue_rate": detect_stats["dropped"] / max(1, detect_stats["pushed"]),
+            "face_queue": detect_worker.faces_dropped,
+            "face_queue_rate": detect_worker.faces_dropped / max(1, faces_total),
+        },
+        "cpu": {name: {"seconds": stage.cpu_time, "share_of_wall": stage.cpu_time / wall if wall > 0 else 0.0}
+                for name, stage in stages.items()},
+        "cascade": cascade_report(detect_worker),
+    }
+
+
+def cascade_report(detect_worker):
+    frames, rois, pixels, seconds = detect_worker.cascade_stats
+    if not detect_worker.cascade or not frames:
+        return None
+    full = config.CASCADE_FULL_INPUT
+    return {
+        "rois_per_frame": rois / frames,
+        "pixel_share_of_full_pass": pixels / (frames * full * full),
+        "ms_per_frame": 1000 * seconds / frames,
+        "full_pass_ms": 1000 * detect_worker.full_pass_time if detect_worker.full_pass_time else None,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Returns a list of regressions: fps down, or p95 latency up, by more than tolerance (a fraction).
+    """
+    problems = []
+    if baseline["fps"] and report["fps"] < baseline["fps"] * (1 - tolerance):
+        problems.append(f"fps {report['fps']:.2f} vs {baseline['fps']:.2f}")
+    for key in ("frame_to_detection", "frame_to_recognition"):
+        old = baseline["latency_ms"][key]["p95"]
+        new = report["latency_ms"][key]["p95"]
+        if old and new and new > old * (1 + tolerance):
+            problems.append(f"{key} p95 {new:.1f} ms vs {old:.1f} ms")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the live pipeline without a camera")
+    parser.add_argument("--source", default="synthetic", help="Video file to play, or 'synthetic'")
+    parser.add_argument("--realtime", action="store_true", help="Pace frames at the source fps instead of as fast as possible")
+    parser.add_argument("--frames", type=int, default=300, help="Synthetic frames to generate")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds")
+    parser.add_argument("--fps", type=float, default=30.0, help="Synthetic source frame rate")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--batch_size", type=int, default=None, help="Override DETECT_BATCH_SIZE")
+    parser.add_argument("--cascade", action="store_true", help="Use two-stage body -> face detection (DETECT_CASCADE)")
+    parser.add_argument("--output", default="bench_output.json", help="Where to write the JSON report")
+    parser.add_argument("--compare", help="Earlier report to check for regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed regression, as a fraction")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+
+    lat = report["latency_ms"]
+    print(f"[Bench] {report['frames_detected']} frames in {report['wall_seconds']:.1f}s = {report['fps']:.2f} fps")
+    for key, stats in lat.items():
+        if stats["count"]:
+            print(f"[Bench] {key}: p50 {stats['p50']:.1f} ms, p95 {stats['p95']:.1f} ms, p99 {stats['p99']:.1f} ms (n={stats['count']})")
+    print(f"[Bench] drops: detect queue {100 * report['drops']['detect_queue_rate']:.1f}%, "
+          f"face queue {100 * report['drops']['face_queue_rate']:.1f}%")
+    if report["cascade"]:
+        cas = report["cascade"]
+        print(f"[Bench] cascade: {cas['ms_per_frame']:.1f} ms/frame, {100 * cas['pixel_share_of_full_pass']:.0f}% of full-pass pixels")
+    print("[Bench] cpu: " + ", ".join(f"{name} {stats['seconds']:.2f}s" for name, stats in report["cpu"].items()))
+    print(f"[Bench] Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(report, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"[Bench] REGRESSION: {problem}")
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
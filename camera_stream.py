@@ -3,23 +3,50 @@
 import cv2
 import argparse
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
 class CameraStream:
-    def __init__(self, cam_index=None, max_devices=10):
+    """
+    Wraps a cv2.VideoCapture device.
+    With threaded=True a background thread keeps decoding frames and only the newest one is kept, so read_frame()
+    always hands back the freshest frame instead of whatever has been sitting in the driver's buffer.
+    buffer_size is passed on as a CAP_PROP_BUFFERSIZE hint; not every backend honours it.
+    """
+    def __init__(self, cam_index=None, max_devices=10, threaded=False, buffer_size=None):
         self.cam_index = cam_index if cam_index is not None else self._prompt_for_camera(max_devices)
         self.cap = cv2.VideoCapture(self.cam_index)
         if not self.cap.isOpened():
             raise RuntimeError(f"Failed to open camera {self.cam_index}")
+        if buffer_size is not None:
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+
+        self.threaded = threaded
+        self.captured = 0
+        self.delivered = 0
+        self.skipped = 0  # frames overwritten in the latest slot before anyone read them
+        self._latest = None
+        self._latest_seq = 0
+        self._read_seq = 0
+        self._error = None
+        self._cond = threading.Condition()
+        self._running = threaded
+        if threaded:
+            self._capture_thread = threading.Thread(target=self._capture_loop, daemon=True, name="CameraCapture")
+            self._capture_thread.start()
 
     @staticmethod
     def list_available_cameras(max_devices=10):
-        available = []
-        for i in range(max_devices):
+        # Opening a device that isn't there can take a while to time out, so probe them all at once.
+        def probe(i):
             cap = cv2.VideoCapture(i)
-            if cap.isOpened():
-                available.append(i)
-                cap.release()
-        return available
+            opened = cap.isOpened()
+            cap.release()
+            return opened
+
+        with ThreadPoolExecutor(max_workers=max_devices) as pool:
+            return [i for i, opened in zip(range(max_devices), pool.map(probe, range(max_devices))) if opened]
 
     def _prompt_for_camera(self, max_devices):
         cameras = self.list_available_cameras(max_devices)
@@ -39,18 +66,64 @@ class CameraStream:
                 pass
             print("Invalid selection.")
 
-    def read_frame(self):
+    def _capture_loop(self):
+        while self._running:
+            ret, frame = self.cap.read()
+            with self._cond:
+                if not ret:
+                    self._error = "Failed to read frame from camera."
+                    self._cond.notify_all()
+                    return
+                if self._latest_seq > self._read_seq:
+                    self.skipped += 1
+                self._latest = frame
+                self._latest_seq += 1
+                self.captured += 1
+                self._cond.notify_all()
+
+    def read_frame(self, out=None, timeout=1.0):
+        # If out is given (and matches the camera's frame size) the frame is decoded/copied straight into it.
         if not self.cap.isOpened():
             raise RuntimeError("Camera is not opened.")
-        ret, frame = self.cap.read()
+        if self.threaded:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self._latest_seq > self._read_seq or self._error, timeout):
+                    raise RuntimeError("Timed out waiting for a frame from camera.")
+                if self._latest_seq == self._read_seq:
+                    raise RuntimeError(self._error)
+                frame = self._latest
+                self._read_seq = self._latest_seq
+                self.delivered += 1
+            if out is not None and out.shape == frame.shape:
+                np.copyto(out, frame)
+                return out
+            return frame
+
+        ret, frame = self.cap.read(out)
         if not ret:
             raise RuntimeError("Failed to read frame from camera.")
+        self.captured += 1
+        self.delivered += 1
         return frame
 
+    def skip_frame(self):
+        # Advance past a frame without decoding it. The threaded reader has already decoded it, so just consume it.
+        if self.threaded:
+            self.read_frame()
+            return
+        if not self.cap.grab():
+            raise RuntimeError("Failed to grab frame from camera.")
+        self.captured += 1
+
+    def stats(self):
+        return {"captured": self.captured, "delivered": self.delivered, "skipped": self.skipped}
+
     def release(self):
+        if self.threaded and self._running:
+            self._running = False
+            self._capture_thread.join(timeout=2)
         if self.cap.isOpened():
             self.cap.release()
-        cv2.destroyAllWindows()
 
     def stream(self, window_name="Camera Stream"):
         print(f"Streaming from camera {self.cam_index}. Press 'q' to quit.")
@@ -60,6 +133,7 @@ class CameraStream:
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
         self.release()
+        cv2.destroyAllWindows()
 
 def main():
     parser = argparse.ArgumentParser(description="Test CameraStream module")
@@ -0,0 +1,41 @@
+# cascade.py
+# Helpers for DetectWorker's two-stage mode: a cheap low resolution pass over the whole frame finds bodies, then
+# only the (upscaled) upper part of each body goes through a second pass that looks for faces. Small faces get far
+# more input pixels than they would in a single shrunken full-frame pass, without paying for a big full-frame pass.
+
+import numpy as np
+
+
+def body_rois(boxes, confidences, width, height, top_fraction=0.5, padding=0.1, max_rois=8):
+    """
+    Turns body boxes into the regions the face pass should look at: the top top_fraction of each body (where the
+    head is), padded by padding (a fraction of the box size) on every side and clipped to the frame.
+    Only the max_rois most confident bodies are kept. Returns an (N, 4) int array of [x, y, w, h].
+    """
+    if len(boxes) == 0:
+        return np.empty((0, 4), dtype=np.int64)
+    order = np.argsort(-np.asarray(confidences))[:max_rois]
+    boxes = np.asarray(boxes, dtype=np.float64)[order]
+    x, y, w = boxes[:, 0], boxes[:, 1], boxes[:, 2]
+    h = boxes[:, 3] * top_fraction
+    pad_x = w * padding
+    pad_y = h * padding
+    x0 = np.clip(x - pad_x, 0, width).astype(np.int64)
+    y0 = np.clip(y - pad_y, 0, height).astype(np.int64)
+    x1 = np.clip(x + w + pad_x, 0, width).astype(np.int64)
+    y1 = np.clip(y + h + pad_y, 0, height).astype(np.int64)
+    rois = np.stack([x0, y0, x1 - x0, y1 - y0], axis=1)
+    return rois[(rois[:, 2] > 0) & (rois[:, 3] > 0)]
+
+
+def to_frame_coords(boxes, roi):
+    # Boxes decoded against an ROI crop, shifted back into full-frame pixels.
+    return np.asarray(boxes, dtype=np.int64).reshape(-1, 4) + np.array([roi[0], roi[1], 0, 0], dtype=np.int64)
+
+
+def input_pixels(body_size, face_size, frames, rois):
+    """
+    Pixels fed to the net by the cascade: one body_size pass per frame plus one face_size pass per ROI.
+    Conv cost grows with input pixels, so this against full_size**2 per frame is the compute the cascade saves.
+    """
+    return frames * body_size * body_size + rois * face_size * face_size
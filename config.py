@@ -1,9 +1,17 @@
 # CAMERA SETTINGS
 FACE_QUEUE_SIZE = 5
 DETECT_QUEUE_SIZE = 5
-FRAME_INTERVAL = 1  # seconds or frame skip
+FRAME_SAMPLING = "stride"   # "stride", "time" or "adaptive" - see producer.FrameScheduler
+FRAME_INTERVAL = 1  # seconds or frame skip: frames between pushes for "stride" (1 = every frame), seconds for "time"
+ADAPTIVE_MIN_INTERVAL = 0.0 # Bounds (seconds) on the push interval the "adaptive" mode may pick
+ADAPTIVE_MAX_INTERVAL = 1.0
+ADAPTIVE_SMOOTHING = 0.2    # How fast the adaptive interval follows detector load, 0-1
 MAX_CAM_DEVICES = 10
 DEFAULT_CAMERA = None  # Set to an integer like 0 to skip selection prompt
+CAMERA_THREADED = False     # Capture on a background thread and only ever hand out the newest frame
+CAMERA_BUFFER_SIZE = None   # CAP_PROP_BUFFERSIZE hint for the driver, e.g. 1. None leaves the backend default
+CAMERA_SOURCES = None       # Several cameras sharing one set of workers, e.g. [0, 1]. None = the single --cam camera
+CAMERA_FPS_BUDGET = None    # Max frames per second each camera may push; a dict like {0: 10, 1: 5} sets it per camera
 # MODEL CONFIGURATION
 ## Body and Face Detection
 DETECT_CFG_PATH = "models/people-r-people.cfg"
@@ -11,6 +19,13 @@ DETECT_WEIGHTS_PATH = "models/people-r-people.weights"
 DETECT_NAMES_PATH = "models/people-r-people.names"
 ## Facial Recognition Model - right now is built into cv2
 TARGET_FACE_PATH = "target/trained_target.xml"
+RECOG_DISTANCE_THRESHOLD = 60.0  # LBPH distance at or below which a face counts as the target. Lower is stricter.
+EVAL_REPORT_PATH = "target/eval_report.json"  # Where `targetter --test_recognition --eval` writes its report
+EVAL_HOLDOUT_FRACTION = 0.2 # Share of target faces held out of training to score as genuine matches
+EVAL_TARGET_FAR = 0.01      # False accept rate the suggested threshold aims for
+RECOG_RELOAD_INTERVAL = None  # Seconds between FaceWorker checks for a newer TARGET_FACE_PATH to swap in live. None = never
+FACE_BATCH_SIZE = 8         # Max face crops FaceWorker pulls off the queue per pass
+FACE_BATCH_TIMEOUT = 0.0    # Don't wait around for more faces, just take whatever is already queued
 #RECOG_CFG_PATH = "models/people-r-people.cfg"
 #RECOG_WEIGHTS_PATH = "models/people-r-people.weights"
 #RECOG_NAMES_PATH = "models/people-r-people.names"
@@ -19,5 +34,71 @@ INPUT_DIR = "target/raw"        # Directory with full unprocessed images of targ
 OUTPUT_DIR = "target/processed"      # Where to save the detected and cropped faces of the target
 OFFTARGET_INPUT_DIR = "offtarget/raw"  # same as above but for images that well be used for testing recog rates.
 OFFTARGET_OUTPUT_DIR = "offtarget/processed"
+PACKAGER_WORKERS = None     # Threads for reading/decoding images in the packager, None = one per CPU
+PACKAGER_BATCH_SIZE = 8     # Images per forward pass in the packager
 CONFIDENCE_THRESHOLD = 0.5
 FACE_CLASS_ID = 1
+DETECT_NMS_THRESHOLD = 0.3  # Overlap threshold for NMS on live detections, None to keep overlapping boxes
+# IDENTITY CLUSTERING (targetter --cluster)
+CLUSTER_NEIGHBORS = 5       # Each crop links to crops that are mutually among each other's this many nearest neighbours
+CLUSTER_MIN_SIMILARITY = 0.15  # ...if their (mean-centered LBP) cosine similarity is at least this
+CLUSTER_LSH_TABLES = 8      # SimHash tables proposing neighbour candidates. More finds more links, costs linearly more
+CLUSTER_LSH_BITS = None     # Hash bits per table. None sizes buckets from the crop count and CLUSTER_MAX_BUCKET
+CLUSTER_MAX_BUCKET = 64     # Crops compared against each other at most per bucket, which keeps the whole thing near-linear
+CLUSTER_REPORT_PATH = "target/identity_cluster.json"  # Which crops were picked as the common identity, and why
+# DETECTION BATCHING
+DETECT_BATCH_SIZE = 1       # Max frames per forward pass. 1 keeps the old one-frame-at-a-time behaviour.
+DETECT_BATCH_TIMEOUT = 0.02 # Seconds to wait for a batch to fill after the first frame arrives.
+# DNN BACKEND
+DNN_BACKEND = "opencv"      # "opencv", "openvino" (needs an OpenCV built with Inference Engine) or "default"
+DNN_TARGET = "cpu"          # "cpu", "cpu_fp16" (newer OpenCV), "opencl", "opencl_fp16"
+DETECT_INPUT_SIZE = 416     # Detection net input resolution (multiple of 32). Bigger finds smaller faces but costs ~quadratically more
+DNN_THREADS = None          # cv2.setNumThreads for inference. None leaves OpenCV's default
+DNN_PROFILE_PATH = "models/dnn_profile.json"  # Written by `live --autotune` and applied on later runs; command line flags still win
+AUTOTUNE_INPUT_SIZES = (320, 416, 512, 608)
+AUTOTUNE_TARGET_MS = 150    # Autotune picks the largest input size whose forward pass fits in this many ms
+AUTOTUNE_RUNS = 5           # Timed forward passes per combination
+# LIVE HARVESTING (live --package)
+HARVEST_HASH_DISTANCE = 10  # A crop within this many bits (of 64) of the dHash of one already kept is a near-duplicate
+HARVEST_RATE = 1.0          # Crops saved per second at most, on average
+HARVEST_BURST = 5           # ...with up to this many in a quick burst
+HARVEST_WRITE_QUEUE = 32    # Crops waiting on the writer thread before new ones get dropped
+HARVEST_MAX_CROPS = None    # Stop saving after this many crops in one session. None = no limit
+# CASCADE DETECTION
+DETECT_CASCADE = False      # Two stages: low-res pass for bodies over the whole frame, then faces in upscaled body crops
+BODY_CLASS_ID = 0
+CASCADE_BODY_INPUT = 320    # Net input size for the whole-frame body pass (multiple of 32)
+CASCADE_FACE_INPUT = 256    # Net input size each body crop gets upscaled to for the face pass (multiple of 32)
+CASCADE_FULL_INPUT = 832    # Full-frame pass the cascade is compared against in the compute-saved report
+CASCADE_ROI_TOP = 0.5       # Share of each body box, from the top, searched for a face
+CASCADE_ROI_PADDING = 0.1   # Padding around each crop, as a fraction of its size
+CASCADE_MAX_ROIS = 8        # Most confident bodies per frame that get a face pass
+# DETECTION ENGINE
+DETECT_ENGINE = "thread"    # "thread" runs one DetectWorker in-process, "process" runs DETECT_PROCESSES replicas in child processes
+DETECT_PROCESSES = 2
+# SHARED FRAME RING
+USE_FRAME_RING = False      # Decode frames into preallocated shared memory slots and only pass slot indices through the queues
+FRAME_RING_SLOTS = 8        # Needs to cover every queue's maxsize plus whatever the workers hold in flight (grown to fit if it doesn't)
+# TRACKING
+TRACKING = False            # Track faces across frames; only detect on keyframes and only re-recognize stale tracks
+KEYFRAME_INTERVAL = 10      # Run detection at least every this many frames (sooner if a track is lost)
+TRACKER_TYPE = None         # OpenCV tracker between keyframes: "KCF", "MIL", "CSRT"... None just holds the last box
+TRACK_IOU_THRESHOLD = 0.3   # Min overlap to match a detection to an existing track
+TRACK_MAX_MISSES = 3        # Keyframes a track can go unmatched before it's dropped
+TRACK_RECOG_DECAY = 0.95    # Per frame decay of a track's cached recognition confidence
+TRACK_RECOG_MIN = 0.5       # Re-recognize a track once its cached confidence falls below this
+# METRICS
+METRICS_PORT = None         # Serve Prometheus text on http://127.0.0.1:PORT/metrics (JSON on /metrics.json). None = off
+METRICS_JSON_PATH = None    # Periodically dump a JSON snapshot of the metrics here. None = off
+METRICS_DUMP_INTERVAL = 10  # Seconds between JSON dumps
+# RESULT SINK
+SHOW_FEED = False           # Preview window with boxes and recognition labels drawn on (live --show_feed)
+DEBUG_RESULTS = False       # Print every detection and recognition, not just matches (live --debug)
+RESULT_LOG_PATH = None      # JSON lines log of detections and recognitions, e.g. "logs/results.jsonl" (".gz" compresses it)
+RESULT_LOG_FLUSH_INTERVAL = 2.0  # Seconds between log flushes
+RESULT_VIDEO_PATH = None    # Record the annotated frames, e.g. "logs/annotated_{source}.avi" ({source} = camera)
+RESULT_VIDEO_FOURCC = "MJPG"
+RESULT_VIDEO_FPS = 10
+SINK_QUEUE_SIZE = 256       # Events the sink can fall behind by before new ones get dropped
+SINK_MAX_PENDING = 16       # Frames held waiting for their detections to come back
+SINK_JOIN_TIMEOUT = 0.5     # Seconds a frame waits for its faces' recognition results before it's drawn without them
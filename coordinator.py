@@ -1,43 +1,203 @@
 import threading
+import time
 from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
 from camera_stream import CameraStream
-from producer import FrameProducer
+from producer import FrameProducer, FrameScheduler
 from workers import FaceWorker, DetectWorker
-#from face_worker import FaceWorker
-#from detect_worker import DetectWorker
+from process_engine import DetectProcessPool
+from frame_ring import SharedFrameRing
+from frame_queue import FairQueue
+from tracker import TrackStore, TrackWorker
+from metrics import REGISTRY as metrics, MetricsServer
+from model_registry import MODELS
+from result_sink import ResultSink
+from harvester import FaceHarvester
 import config
 
-def run_system():
+def frame_budget(source_id):
+    # CAMERA_FPS_BUDGET is either one cap for every camera or a {cam_index: fps} dict.
+    budget = config.CAMERA_FPS_BUDGET
+    if isinstance(budget, dict):
+        return budget.get(source_id)
+    return budget
+
+def open_cameras(cam_indices):
+    # Cameras open in parallel; each one can take a good fraction of a second to come up.
+    def open_camera(i):
+        return CameraStream(cam_index=i, threaded=config.CAMERA_THREADED, buffer_size=config.CAMERA_BUFFER_SIZE)
+
+    with ThreadPoolExecutor(max_workers=len(cam_indices)) as pool:
+        return list(pool.map(open_camera, cam_indices))
+
+def run_system(cam_index=None, detect_engine=None, detect_processes=None, tracking=None, cam_indices=None, started_at=None,
+               show_feed=None, debug=None, log_path=None, video_path=None, package=False, reload_interval=None):
+    # package=True swaps the recognizer for a FaceHarvester that saves new, distinct face crops to config.OUTPUT_DIR.
+    # started_at is when the process started (run.py passes it in) so the startup report covers imports too.
+    started_at = started_at or time.time()
     stop_event = threading.Event()
-    camera = CameraStream()
+    if cam_indices is None:
+        cam_indices = list(config.CAMERA_SOURCES) if cam_index is None and config.CAMERA_SOURCES else [cam_index]
+    detect_engine = detect_engine or config.DETECT_ENGINE
+
+    # Get the models loading and warming up in the background while we wait on the cameras.
+    if detect_engine != "process":
+        MODELS.preload_darknet(config.DETECT_CFG_PATH, config.DETECT_WEIGHTS_PATH)
+    if not package:
+        MODELS.preload_lbph(config.TARGET_FACE_PATH)
+    cameras = open_cameras(cam_indices)
+    cameras_ready_at = time.time()
 
-    detect_queue = Queue(maxsize=config.DETECT_QUEUE_SIZE)
+    # One detect queue for every camera, with a lane per camera that the detector serves round-robin.
+    detect_queue = FairQueue(maxsize=config.DETECT_QUEUE_SIZE, name="detect")
     face_queue = Queue(maxsize=config.FACE_QUEUE_SIZE)
 
-    producer = FrameProducer(camera, [detect_queue], stop_event)
-    detect_worker = DetectWorker(detect_queue, stop_event, face_output_queue=face_queue, name="DetectWorker")
-    face_worker = FaceWorker(face_queue, stop_event, name="FaceWorker")
+    tracking = config.TRACKING if tracking is None else tracking
+    if tracking and detect_engine == "process":
+        raise ValueError("Tracking needs the in-process detect engine; turn off one of TRACKING or DETECT_ENGINE='process'.")
+    if tracking and len(cameras) > 1:
+        raise ValueError("Tracking follows a single scene; run one camera or turn off TRACKING.")
+    if tracking and config.DETECT_BATCH_SIZE > 1:
+        # A batch would hand the tracker the batch's skipped frames before its keyframes had been detected, and
+        # with detection on only every KEYFRAME_INTERVAL-th frame there's next to nothing to batch anyway.
+        raise ValueError("Tracking needs DETECT_BATCH_SIZE = 1; turn off one of TRACKING or detection batching.")
+    sink = ResultSink(stop_event, show_feed=show_feed, debug=debug, log_path=log_path, video_path=video_path)
+    output_queues = [detect_queue]
+    if sink.frames is not None:
+        output_queues.append(sink.frames)
+
+    frame_ring = None
+    if config.USE_FRAME_RING:
+        # Slot size has to match what the cameras actually hand back, so size the ring off real frames.
+        frame_shapes = {camera.cam_index: camera.read_frame().shape for camera in cameras}
+        frame_shape = frame_shapes[cameras[0].cam_index]
+        if len(set(frame_shapes.values())) > 1:
+            raise ValueError(f"The frame ring needs every camera at the same resolution, got {frame_shapes}.")
+        # Every queue a slot index can sit in and every worker that can hold slots has to fit at once, or the
+        # producer finds the ring full while the detect queue is empty: a lane per camera in the detect queue, the
+        # sink's frame lane, the detect stage (a batch, or one frame per replica process), with tracking the track
+        # queue plus the frame the TrackWorker is on, and the slot each camera's producer is decoding into.
+        if detect_engine == "process":
+            detect_slots = detect_processes or config.DETECT_PROCESSES
+        else:
+            detect_slots = config.DETECT_BATCH_SIZE
+        num_slots = max(config.FRAME_RING_SLOTS, len(cameras) * config.DETECT_QUEUE_SIZE + detect_slots + len(cameras)
+                        + (sink.frames.maxsize if sink.frames is not None else 0)
+                        + (config.DETECT_QUEUE_SIZE + 1 if tracking else 0))
+        frame_ring = SharedFrameRing(num_slots, frame_shape, num_consumers=len(output_queues))
+        print(f"[Coordinator] Frame ring: {num_slots} slots of {frame_shape}.")
+        sink.frame_ring = frame_ring
+
+    track_store = None
+    extra_threads = []
+    if detect_engine == "process":
+        detect_worker = DetectProcessPool(detect_queue, stop_event, face_output_queue=face_queue, sink_queue=sink.events,
+                                          num_processes=detect_processes, frame_ring=frame_ring)
+    elif tracking:
+        # detect -> track -> face: the tracker decides which frames get detected and which faces get recognized.
+        track_store = TrackStore()
+        track_queue = Queue(maxsize=config.DETECT_QUEUE_SIZE)
+        detect_worker = DetectWorker(detect_queue, stop_event, face_output_queue=track_queue, name="DetectWorker",
+                                     frame_ring=frame_ring, track_store=track_store)
+        extra_threads.append(TrackWorker(track_queue, stop_event, face_queue, track_store, frame_ring=frame_ring,
+                                         sink_queue=sink.events))
+    else:
+        detect_worker = DetectWorker(detect_queue, stop_event, face_output_queue=face_queue, name="DetectWorker",
+                                     frame_ring=frame_ring, sink_queue=sink.events)
+
+    def make_scheduler(source_id):
+        # The detector's time is split between the cameras, so each one plans around its share of it.
+        return FrameScheduler(config.FRAME_SAMPLING, config.FRAME_INTERVAL,
+                              load_probe=lambda: (detect_worker.service_time * len(cameras), detect_queue.lane_depth(source_id)),
+                              min_interval=config.ADAPTIVE_MIN_INTERVAL, max_interval=config.ADAPTIVE_MAX_INTERVAL,
+                              smoothing=config.ADAPTIVE_SMOOTHING, max_fps=frame_budget(source_id))
+
+    producers = []
+    for camera in cameras:
+        source_id = camera.cam_index
+        producers.append(FrameProducer(camera, output_queues, stop_event, frame_ring=frame_ring,
+                                       scheduler=make_scheduler(source_id), source_id=source_id))
+        metrics.gauge("queue_depth", lambda source_id=source_id: detect_queue.lane_depth(source_id),
+                      queue="detect", source=source_id)
+    if package:
+        face_worker = FaceHarvester(face_queue, stop_event)
+    else:
+        face_worker = FaceWorker(face_queue, stop_event, name="FaceWorker", track_store=track_store, result_queue=sink.events,
+                                 reload_interval=reload_interval)
+
+    threads = producers + [detect_worker] + extra_threads + [face_worker, sink]
+    if len(cameras) > 1:
+        print(f"[Coordinator] Sharing detection and recognition between {len(cameras)} cameras: {cam_indices}")
+
+    metrics.gauge("queue_depth", face_queue.qsize, queue="face")
+    metrics.gauge("queue_depth", sink.events.qsize, queue="sink")
+    if tracking:
+        metrics.gauge("queue_depth", track_queue.qsize, queue="track")
+        metrics.gauge("tracks_active", lambda: len(track_store.tracks))
+    if frame_ring is not None:
+        metrics.gauge("frame_ring_slots_in_use", frame_ring.in_use)
+    metrics_server = None
+    if config.METRICS_PORT:
+        metrics_server = MetricsServer(metrics, config.METRICS_PORT)
+        metrics_server.start()
 
-    threads = [producer, detect_worker, face_worker]
     for t in threads:
         t.start()
+    workers_ready_at = time.time()
+    print(f"[Coordinator] Startup: cameras ready after {cameras_ready_at - started_at:.2f}s, "
+          f"workers after {workers_ready_at - started_at:.2f}s")
+    print("[Coordinator] Model loads (in the background): " +
+          ", ".join(f"{kind} {1000 * max(times):.0f} ms" for kind, times in MODELS.load_times.items()))
+    metrics.gauge("startup_seconds", lambda: cameras_ready_at - started_at, phase="cameras_ready")
+    metrics.gauge("startup_seconds", lambda: workers_ready_at - started_at, phase="workers_ready")
 
+    error = None
     try:
         print("[Coordinator] System running. Press Ctrl+C to stop.")
+        next_dump = time.monotonic() + config.METRICS_DUMP_INTERVAL
+        first_result_reported = False
         while not stop_event.is_set():
             for t in threads:
                 if not t.is_alive():
                     raise RuntimeError(f"{t.name} thread died unexpectedly.")
+            if not first_result_reported and detect_worker.first_result_at is not None:
+                # First frame all the way through detection: the pipeline is actually up.
+                first_result = detect_worker.first_result_at - started_at
+                print(f"[Coordinator] Time to first result: {first_result:.2f}s")
+                metrics.gauge("startup_seconds", lambda: first_result, phase="first_result")
+                first_result_reported = True
+            if config.METRICS_JSON_PATH and time.monotonic() >= next_dump:
+                metrics.dump_json(config.METRICS_JSON_PATH)
+                next_dump = time.monotonic() + config.METRICS_DUMP_INTERVAL
             threading.Event().wait(1)
     except KeyboardInterrupt:
         print("\n[Coordinator] Shutdown signal received.")
         stop_event.set()
+    except RuntimeError as e:
+        # Still shut everything else down properly (log flushed, video files finished, frame ring freed) first.
+        error = e
+        stop_event.set()
 
     print("[Coordinator] Waiting for threads to finish...")
     for t in threads:
         t.join()
 
-    print("[Coordinator] Releasing camera...")
-    camera.release()
+    if config.METRICS_JSON_PATH:
+        metrics.dump_json(config.METRICS_JSON_PATH)
+    if metrics_server is not None:
+        metrics_server.stop()
+
+    for camera, producer in zip(cameras, producers):
+        print(f"[Coordinator] Camera {camera.cam_index} stats: {camera.stats()}")
+        print(f"[Coordinator] Producer {producer.source_id} stats: {producer.stats()}")
+
+    print("[Coordinator] Releasing cameras...")
+    for camera in cameras:
+        camera.release()
+    if frame_ring is not None:
+        frame_ring.close()
+        frame_ring.unlink()
 
+    if error is not None:
+        raise error
     print("[Coordinator] All threads stopped. Exiting cleanly.")
@@ -0,0 +1,204 @@
+# dnn_backend.py
+# Which cv2.dnn backend/target the detection net runs on, at what input size and with how many threads, plus the
+# --autotune sweep that times the combinations this OpenCV build can actually run and saves the fastest as a
+# profile (config.DNN_PROFILE_PATH) that later runs pick up.
+
+import os
+import json
+import time
+import platform
+import cv2
+import numpy as np
+
+import config
+
+BACKENDS = {
+    "default": cv2.dnn.DNN_BACKEND_DEFAULT,
+    "opencv": cv2.dnn.DNN_BACKEND_OPENCV,
+    "openvino": cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE,
+}
+TARGETS = {
+    "cpu": cv2.dnn.DNN_TARGET_CPU,
+    "opencl": cv2.dnn.DNN_TARGET_OPENCL,
+    "opencl_fp16": cv2.dnn.DNN_TARGET_OPENCL_FP16,
+}
+# Only in newer OpenCV builds.
+if hasattr(cv2.dnn, "DNN_TARGET_CPU_FP16"):
+    TARGETS["cpu_fp16"] = cv2.dnn.DNN_TARGET_CPU_FP16
+CPU_TARGETS = ("cpu", "cpu_fp16")
+
+# The config settings a profile covers.
+SETTINGS = ("DNN_BACKEND", "DNN_TARGET", "DETECT_INPUT_SIZE", "DNN_THREADS")
+
+
+def configure_net(net, backend=None, target=None):
+    backend = backend or config.DNN_BACKEND
+    target = target or config.DNN_TARGET
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown DNN backend {backend!r}, expected one of {sorted(BACKENDS)}")
+    if target not in TARGETS:
+        raise ValueError(f"Unknown DNN target {target!r}, expected one of {sorted(TARGETS)}")
+    net.setPreferableBackend(BACKENDS[backend])
+    net.setPreferableTarget(TARGETS[target])
+
+
+def current_settings():
+    return {name: getattr(config, name) for name in SETTINGS}
+
+
+def apply_settings(settings):
+    """
+    Copies settings ({config name: value}) onto config and applies the thread count. Unknown keys are ignored,
+    None values leave the config default alone.
+    """
+    for name in SETTINGS:
+        if settings.get(name) is not None:
+            setattr(config, name, settings[name])
+    if config.DNN_THREADS:
+        cv2.setNumThreads(config.DNN_THREADS)
+
+
+def load_profile(path=None):
+    """
+    Applies a profile saved by autotune, if there is one. Returns its settings, or None.
+    """
+    path = path or config.DNN_PROFILE_PATH
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        profile = json.load(f)
+    # A profile timed on another OpenCV build may name a backend this one doesn't have.
+    if profile["settings"].get("DNN_BACKEND") not in BACKENDS or profile["settings"].get("DNN_TARGET") not in TARGETS:
+        print(f"[DNN] Ignoring {path}: it was tuned for a backend/target this OpenCV build doesn't have.")
+        return None
+    apply_settings(profile["settings"])
+    print(f"[DNN] Using tuned profile from {path}: {profile['settings']}")
+    return profile["settings"]
+
+
+def candidate_combinations():
+    """
+    CPU-capable (backend, target) pairs worth timing: backends the build reports any target for, crossed with the
+    CPU targets. Whether a pair really works is only known once a forward pass has been run on it.
+    """
+    combos = []
+    for backend in ("opencv", "openvino"):
+        if len(cv2.dnn.getAvailableTargets(BACKENDS[backend])) == 0:
+            continue
+        for target in CPU_TARGETS:
+            # OpenCV only implements CPU_FP16 on ARM; elsewhere it quietly falls back to plain CPU, and timing the
+            # same thing twice would just let noise pick the "winner".
+            if target == "cpu_fp16" and platform.machine().lower() not in ("aarch64", "arm64"):
+                continue
+            if target in TARGETS:
+                combos.append((backend, target))
+    return combos
+
+
+def sample_frames(folders=None, count=8):
+    """
+    Frames to time the net on: images from the raw target/off-target folders if there are any, otherwise synthetic
+    frames (noise with face crops pasted in).
+    """
+    folders = folders or (config.INPUT_DIR, config.OFFTARGET_INPUT_DIR)
+    frames = []
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for filename in sorted(os.listdir(folder)):
+            if len(frames) >= count:
+                return frames
+            image = cv2.imread(os.path.join(folder, filename))
+            if image is not None:
+                frames.append(image)
+    if frames:
+        return frames
+    from frame_source import SyntheticSource
+    source = SyntheticSource(num_frames=count, faces_dir=config.OUTPUT_DIR)
+    return [source.read_frame() for _ in range(count)]
+
+
+def time_forward(backend, target, size, threads, frames, runs):
+    """
+    Median seconds for one forward pass over a single frame, plus the raw outputs of the last pass.
+    """
+    if threads:
+        cv2.setNumThreads(threads)
+    net = cv2.dnn.readNetFromDarknet(config.DETECT_CFG_PATH, config.DETECT_WEIGHTS_PATH)
+    configure_net(net, backend, target)
+    layer_names = net.getLayerNames()
+    output_layers = [layer_names[i - 1] for i in net.getUnconnectedOutLayers()]
+
+    times = []
+    outputs = None
+    for i in range(runs + 1):
+        blob = cv2.dnn.blobFromImage(frames[i % len(frames)], 1/255.0, (size, size), swapRB=True, crop=False)
+        start = time.perf_counter()
+        net.setInput(blob)
+        outputs = net.forward(output_layers)
+        if i:  # first pass is warm-up
+            times.append(time.perf_counter() - start)
+    return float(np.median(times)), outputs
+
+
+def autotune(frames, sizes=None, thread_counts=None, runs=None, target_ms=None, tolerance=0.05):
+    """
+    Times every candidate backend/target, thread count and input size on frames. Lower precision targets only count
+    if their outputs stay within tolerance of the plain OpenCV/CPU run at the same size. The input size chosen is
+    the largest whose best forward time fits target_ms (smaller is always faster, so "fastest" alone would always
+    pick the smallest); at that size the fastest combination wins.
+    Returns (settings, results) where results has one entry per combination tried.
+    """
+    sizes = sorted(sizes or config.AUTOTUNE_INPUT_SIZES)
+    thread_counts = thread_counts or sorted({1, os.cpu_count() or 1})
+    runs = runs or config.AUTOTUNE_RUNS
+    target_ms = target_ms or config.AUTOTUNE_TARGET_MS
+    previous_threads = cv2.getNumThreads()
+
+    results = []
+    for size in sizes:
+        reference = None
+        for backend, target in candidate_combinations():
+            for threads in thread_counts:
+                entry = {"DNN_BACKEND": backend, "DNN_TARGET": target, "DETECT_INPUT_SIZE": size, "DNN_THREADS": threads}
+                try:
+                    seconds, outputs = time_forward(backend, target, size, threads, frames, runs)
+                except cv2.error as e:
+                    entry["error"] = str(e).strip().splitlines()[-1]
+                    results.append(entry)
+                    print(f"[DNN] {backend}/{target} @ {size}, {threads} threads: failed ({entry['error']})")
+                    continue
+                if reference is None and (backend, target) == ("opencv", "cpu"):
+                    reference = outputs
+                if reference is not None and target != "cpu":
+                    diff = max(float(np.max(np.abs(out[:, 4:] - ref[:, 4:]))) for out, ref in zip(outputs, reference))
+                    entry["max_score_diff"] = diff
+                    if diff > tolerance:
+                        entry["error"] = f"scores drift by {diff:.3f}"
+                entry["ms"] = 1000 * seconds
+                results.append(entry)
+                print(f"[DNN] {backend}/{target} @ {size}, {threads} threads: {entry['ms']:.1f} ms"
+                      + (f" (rejected: {entry['error']})" if "error" in entry else ""))
+    cv2.setNumThreads(previous_threads)
+
+    usable = [entry for entry in results if "error" not in entry]
+    if not usable:
+        raise RuntimeError("No backend/target combination could run the detection net.")
+    fitting = [entry for entry in usable if entry["ms"] <= target_ms]
+    best_size = max(entry["DETECT_INPUT_SIZE"] for entry in fitting) if fitting else sizes[0]
+    best = min((entry for entry in usable if entry["DETECT_INPUT_SIZE"] == best_size), key=lambda entry: entry["ms"])
+    return {name: best[name] for name in SETTINGS}, results
+
+
+def save_profile(settings, results, path=None):
+    path = path or config.DNN_PROFILE_PATH
+    profile = {
+        "settings": settings,
+        "opencv_version": cv2.__version__,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": results,
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(profile, f, indent=1)
+    os.replace(tmp_path, path)
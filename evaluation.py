@@ -0,0 +1,79 @@
+# evaluation.py
+# Scoring helpers for FaceTrainer.evaluate: parallel LBPH scoring and ROC / FAR / FRR / EER over distances.
+# LBPH gives a distance, so lower means "more like the target" and a face is accepted when distance <= threshold.
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+def score_faces(recognizer, faces, workers=4):
+    """
+    Runs recognizer.predict over every face, split into one chunk per worker. Returns the distances as an array.
+    """
+    if len(faces) == 0:
+        return np.empty(0)
+    chunks = np.array_split(np.arange(len(faces)), min(workers, len(faces)))
+
+    def score_chunk(indices):
+        return [recognizer.predict(faces[i])[1] for i in indices]
+
+    with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+        return np.concatenate([np.asarray(scores, dtype=np.float64) for scores in pool.map(score_chunk, chunks)])
+
+
+def roc_curve(genuine, impostor):
+    """
+    Sweeps the acceptance threshold over every observed distance.
+    Returns (thresholds, far, frr): far is the share of impostors accepted, frr the share of genuine faces rejected.
+    """
+    genuine = np.sort(np.asarray(genuine, dtype=np.float64))
+    impostor = np.sort(np.asarray(impostor, dtype=np.float64))
+    thresholds = np.unique(np.concatenate([genuine, impostor, [-np.inf]]))
+    far = np.searchsorted(impostor, thresholds, side="right") / max(len(impostor), 1)
+    frr = 1.0 - np.searchsorted(genuine, thresholds, side="right") / max(len(genuine), 1)
+    return thresholds, far, frr
+
+
+def equal_error_rate(thresholds, far, frr):
+    """
+    Returns (eer, threshold) at the sweep point where FAR and FRR are closest.
+    """
+    i = int(np.argmin(np.abs(far - frr)))
+    return float((far[i] + frr[i]) / 2), float(thresholds[i])
+
+
+def threshold_for_far(thresholds, far, target_far):
+    """
+    Loosest threshold whose FAR is still at or under target_far.
+    """
+    ok = np.nonzero(far <= target_far)[0]
+    return float(thresholds[ok[-1]])
+
+
+def summarize(genuine, impostor, target_far=0.01):
+    thresholds, far, frr = roc_curve(genuine, impostor)
+    eer, eer_threshold = equal_error_rate(thresholds, far, frr)
+    far_threshold = threshold_for_far(thresholds, far, target_far)
+    far_i = int(np.searchsorted(thresholds, far_threshold))
+    # Area under TPR vs FAR; both run from 0 to 1 as the threshold loosens.
+    tpr = 1.0 - frr
+    auc = float(np.sum(np.diff(far) * (tpr[1:] + tpr[:-1]) / 2))
+    finite = np.isfinite(thresholds)
+    # The -inf "reject everything" point keeps the sweep complete but isn't a usable threshold (or valid JSON).
+    as_threshold = lambda t: t if np.isfinite(t) else None
+    return {
+        "genuine_count": int(len(genuine)),
+        "impostor_count": int(len(impostor)),
+        "eer": eer,
+        "eer_threshold": as_threshold(eer_threshold),
+        "target_far": target_far,
+        "suggested_threshold": as_threshold(far_threshold),
+        "far_at_suggested": float(far[far_i]),
+        "frr_at_suggested": float(frr[far_i]),
+        "auc": auc,
+        "roc": {
+            "thresholds": thresholds[finite].tolist(),
+            "far": far[finite].tolist(),
+            "frr": frr[finite].tolist(),
+        },
+    }
@@ -0,0 +1,104 @@
+# face_cache.py
+# Preprocessed (grayscale, resized) face crops for a folder, kept as one .npy array next to the crops so training and
+# testing can start from a single memory-mapped load instead of decoding every jpg again.
+
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+import config
+
+
+class FaceCache:
+    """
+    Cache of a folder of face crops as an (N, height, width) uint8 array plus an index of the files it came from.
+    Entries are keyed by file name, size and mtime; on load only new or changed files get decoded (in parallel),
+    rows for untouched files are carried over from the old array, and deleted files drop out.
+    """
+    IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+    def __init__(self, folder, face_size=(150, 150), workers=None):
+        self.folder = folder
+        self.face_size = tuple(face_size)
+        self.workers = workers or config.PACKAGER_WORKERS or os.cpu_count()
+        base = os.path.join(folder, f".faces_{self.face_size[0]}x{self.face_size[1]}")
+        self.array_path = base + ".npy"
+        self.index_path = base + ".json"
+
+    def _scan(self):
+        entries = []
+        for filename in sorted(os.listdir(self.folder)):
+            if filename.startswith(".") or not filename.lower().endswith(self.IMAGE_EXTENSIONS):
+                continue
+            st = os.stat(os.path.join(self.folder, filename))
+            entries.append({"name": filename, "size": st.st_size, "mtime": st.st_mtime_ns})
+        return entries
+
+    def _read_index(self):
+        # Index is {"entries": one per array row, "unreadable": files that failed to decode last time}
+        empty = {"entries": [], "unreadable": []}
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            faces = np.load(self.array_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return empty, None
+        if not isinstance(index, dict) or len(index.get("entries", ())) != len(faces) or "unreadable" not in index:
+            return empty, None
+        return index, faces
+
+    def _decode(self, filename):
+        img = cv2.imread(os.path.join(self.folder, filename), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            return None
+        # cv2 sizes are (width, height), the array is (height, width)
+        return cv2.resize(img, self.face_size)
+
+    def load(self):
+        """
+        Returns (faces, names): faces is a read-only memory-mapped (N, height, width) uint8 array, names the file
+        each row came from. Files that fail to decode are left out.
+        """
+        entries = self._scan()
+        index, old_faces = self._read_index()
+        known = sorted(index["entries"] + index["unreadable"], key=lambda e: e["name"])
+        if old_faces is not None and known == entries:
+            return old_faces, [e["name"] for e in index["entries"]]
+
+        old_rows = {}
+        if old_faces is not None:
+            old_rows = {(e["name"], e["size"], e["mtime"]): i for i, e in enumerate(index["entries"])}
+        todo = [e for e in entries if (e["name"], e["size"], e["mtime"]) not in old_rows]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            decoded = dict(zip((e["name"] for e in todo), pool.map(self._decode, (e["name"] for e in todo))))
+
+        kept = []
+        unreadable = []
+        rows = []
+        for e in entries:
+            key = (e["name"], e["size"], e["mtime"])
+            if key in old_rows:
+                rows.append(old_faces[old_rows[key]])
+            elif decoded[e["name"]] is not None:
+                rows.append(decoded[e["name"]])
+            else:
+                print(f"[WARN] Could not read {e['name']}")
+                unreadable.append(e)
+                continue
+            kept.append(e)
+
+        faces = np.stack(rows) if rows else np.empty((0, self.face_size[1], self.face_size[0]), np.uint8)
+        # Write next to the old files and swap in, so a crash mid-write never leaves a half-written cache behind.
+        tmp_array = self.array_path + ".tmp.npy"
+        np.save(tmp_array, faces)
+        del old_faces, rows
+        os.replace(tmp_array, self.array_path)
+        with open(self.index_path + ".tmp", "w") as f:
+            json.dump({"entries": kept, "unreadable": unreadable}, f)
+        os.replace(self.index_path + ".tmp", self.index_path)
+        print(f"[INFO] Face cache for {self.folder}: {len(todo)} decoded, {len(entries) - len(todo)} reused")
+
+        return np.load(self.array_path, mmap_mode="r"), [e["name"] for e in kept]
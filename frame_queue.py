@@ -0,0 +1,103 @@
+# frame_queue.py
+# Queue with "latest wins" semantics for the producer -> worker hop.
+
+from collections import OrderedDict, deque
+from queue import Queue
+
+
+class LatestQueue(Queue):
+    """
+    A bounded Queue whose put_latest() never blocks: if the queue is full the oldest item is evicted (and returned,
+    so the caller can clean up after it) in the same locked step, instead of the full()/get_nowait()/put_nowait()
+    dance that can race with the consumer. Keeps counters of what went in and what got dropped.
+    """
+    def __init__(self, maxsize=0, name="queue"):
+        super().__init__(maxsize)
+        self.name = name
+        self.pushed = 0
+        self.dropped = 0
+
+    def put_latest(self, item):
+        with self.not_full:
+            evicted = None
+            if 0 < self.maxsize <= self._qsize():
+                evicted = self._get()
+                self.unfinished_tasks -= 1
+                self.dropped += 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.pushed += 1
+            self.not_empty.notify()
+        return evicted
+
+    def stats(self):
+        with self.mutex:
+            depth = self._qsize()
+            return {
+                "pushed": self.pushed,
+                "delivered": self.pushed - self.dropped - depth,
+                "dropped": self.dropped,
+                "depth": depth,
+            }
+
+
+class FairQueue(LatestQueue):
+    """
+    LatestQueue for several cameras sharing one worker. Payloads go into a lane per "source_id" and get() takes
+    from the lanes round-robin, so a fast camera can't starve a slow one. maxsize applies per lane: put_latest()
+    only ever evicts the oldest frame from the same camera. stats() adds a per-source breakdown.
+    """
+    def __init__(self, maxsize=0, name="queue"):
+        # The Queue machinery itself is unbounded, lanes are capped in put_latest().
+        super().__init__(0, name)
+        self.lane_size = maxsize
+        self.source_stats = {}
+
+    def _init(self, maxsize):
+        self.lanes = OrderedDict()
+
+    def _qsize(self):
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def _put(self, item):
+        self.lanes.setdefault(item.get("source_id"), deque()).append(item)
+
+    def _get(self):
+        for source_id, lane in self.lanes.items():
+            if lane:
+                # Whoever we just served goes to the back of the line.
+                self.lanes.move_to_end(source_id)
+                return lane.popleft()
+        raise IndexError("get from an empty FairQueue")
+
+    def put_latest(self, item):
+        source_id = item.get("source_id")
+        with self.not_full:
+            lane = self.lanes.setdefault(source_id, deque())
+            counts = self.source_stats.setdefault(source_id, {"pushed": 0, "dropped": 0})
+            evicted = None
+            if 0 < self.lane_size <= len(lane):
+                evicted = lane.popleft()
+                self.unfinished_tasks -= 1
+                self.dropped += 1
+                counts["dropped"] += 1
+            lane.append(item)
+            self.unfinished_tasks += 1
+            self.pushed += 1
+            counts["pushed"] += 1
+            self.not_empty.notify()
+        return evicted
+
+    def lane_depth(self, source_id):
+        with self.mutex:
+            lane = self.lanes.get(source_id)
+            return len(lane) if lane else 0
+
+    def stats(self):
+        stats = super().stats()
+        with self.mutex:
+            stats["sources"] = {
+                source_id: dict(counts, depth=len(self.lanes.get(source_id, ())))
+                for source_id, counts in self.source_stats.items()
+            }
+        return stats
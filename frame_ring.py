@@ -0,0 +1,103 @@
+# frame_ring.py
+# Fixed-size ring of preallocated frame slots in shared memory. The producer decodes straight into a free slot and
+# only passes the slot index (plus frame_id/timestamp) through the queues, so frames never get pickled or copied
+# on their way to workers, whether those are threads or processes.
+
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+# Refcounts live at the front of the block, padded so the first frame slot starts on a cache line.
+_HEADER_ALIGN = 64
+
+
+class SharedFrameRing:
+    """
+    num_slots frames of frame_shape/dtype, each with a refcount of how many consumers still hold it.
+    The producer acquire()s a free slot (refcount set to num_consumers), fills view(slot) and publishes the index;
+    every consumer calls release(slot) once it's done with the frame, and at zero the slot is free again.
+
+    The ring can be handed to child processes as a Process argument; the child side attaches to the same block.
+    Only the creating side should call unlink().
+    """
+    def __init__(self, num_slots, frame_shape, dtype=np.uint8, num_consumers=1, lock=None):
+        self.num_slots = num_slots
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.num_consumers = num_consumers
+        self.lock = lock or mp.get_context("spawn").Lock()
+        self._next = 0
+        self._owner = True
+
+        self.slot_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        header = -(-num_slots * 4 // _HEADER_ALIGN) * _HEADER_ALIGN
+        self.shm = shared_memory.SharedMemory(create=True, size=header + num_slots * self.slot_bytes)
+        self._map(header)
+        self.refcounts[:] = 0
+
+    def _map(self, header):
+        self.header_bytes = header
+        self.refcounts = np.ndarray((self.num_slots,), dtype=np.int32, buffer=self.shm.buf)
+        self.slots = np.ndarray((self.num_slots,) + self.frame_shape, dtype=self.dtype,
+                                buffer=self.shm.buf, offset=header)
+
+    def __getstate__(self):
+        return {
+            "name": self.shm.name,
+            "num_slots": self.num_slots,
+            "frame_shape": self.frame_shape,
+            "dtype": self.dtype.str,
+            "num_consumers": self.num_consumers,
+            "lock": self.lock,
+            "header": self.header_bytes,
+        }
+
+    def __setstate__(self, state):
+        self.num_slots = state["num_slots"]
+        self.frame_shape = state["frame_shape"]
+        self.dtype = np.dtype(state["dtype"])
+        self.num_consumers = state["num_consumers"]
+        self.lock = state["lock"]
+        self._next = 0
+        self._owner = False
+        self.slot_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(name=state["name"])
+        # Attaching registers the block with the resource tracker again. Processes spawned by multiprocessing share
+        # the parent's tracker, where that's a no-op, so the parent's unlink() still cleans it up exactly once.
+        self._map(state["header"])
+
+    def acquire(self):
+        """
+        Returns the index of a free slot, now held by every consumer, or None if all slots are still in use.
+        """
+        with self.lock:
+            for i in range(self.num_slots):
+                slot = (self._next + i) % self.num_slots
+                if self.refcounts[slot] == 0:
+                    self.refcounts[slot] = self.num_consumers
+                    self._next = (slot + 1) % self.num_slots
+                    return slot
+        return None
+
+    def view(self, slot):
+        # No copy - this is the shared memory itself. Don't hold on to it after release().
+        return self.slots[slot]
+
+    def release(self, slot):
+        with self.lock:
+            if self.refcounts[slot] > 0:
+                self.refcounts[slot] -= 1
+
+    def in_use(self):
+        with self.lock:
+            return int(np.count_nonzero(self.refcounts))
+
+    def close(self):
+        # Drop our numpy views first, SharedMemory.close() refuses while buffers are still exported.
+        self.refcounts = None
+        self.slots = None
+        self.shm.close()
+
+    def unlink(self):
+        if self._owner:
+            self.shm.unlink()
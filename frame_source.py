@@ -0,0 +1,121 @@
+# frame_source.py
+# Camera stand-ins with the same interface FrameProducer uses on CameraStream (read_frame, skip_frame, release,
+# stats, threaded), so the pipeline can be run and benchmarked without a webcam.
+
+import os
+import time
+import cv2
+import numpy as np
+
+
+class _PacedSource:
+    """
+    Shared pacing/counting. realtime=True sleeps so frames come out at the source's fps, like a real camera would;
+    realtime=False hands them out as fast as they're asked for.
+    """
+    threaded = False
+
+    def __init__(self, fps, realtime):
+        self.fps = fps
+        self.realtime = realtime
+        self.captured = 0
+        self.delivered = 0
+        self._start = None
+
+    def _pace(self):
+        if self._start is None:
+            self._start = time.monotonic()
+        if self.realtime and self.fps:
+            delay = self._start + self.captured / self.fps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def stats(self):
+        return {"captured": self.captured, "delivered": self.delivered, "skipped": 0}
+
+
+class VideoFileSource(_PacedSource):
+    """
+    Plays a recorded video file. With loop=True it starts over at the end instead of reporting end of stream.
+    """
+    def __init__(self, path, realtime=True, loop=False):
+        self.cam_index = path
+        self.loop = loop
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"Failed to open video {path}")
+        super().__init__(self.cap.get(cv2.CAP_PROP_FPS) or 30.0, realtime)
+
+    def _next(self, grab_only, out=None):
+        self._pace()
+        for _ in range(2):
+            if grab_only:
+                ok, frame = self.cap.grab(), None
+            else:
+                ok, frame = self.cap.read(out)
+            if ok:
+                self.captured += 1
+                return frame
+            if not self.loop:
+                break
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        raise RuntimeError("End of video stream.")
+
+    def read_frame(self, out=None):
+        frame = self._next(False, out)
+        self.delivered += 1
+        return frame
+
+    def skip_frame(self):
+        self._next(True)
+
+    def release(self):
+        if self.cap.isOpened():
+            self.cap.release()
+
+
+class SyntheticSource(_PacedSource):
+    """
+    Generates frames: a fixed noise background with face crops (if faces_dir has any) pasted in and drifting
+    across, so detection and recognition have something to chew on. Ends after num_frames if that's set.
+    """
+    def __init__(self, width=1280, height=720, fps=30.0, realtime=False, num_frames=None, faces_dir=None, num_faces=2, seed=0):
+        super().__init__(fps, realtime)
+        self.cam_index = "synthetic"
+        self.width = width
+        self.height = height
+        self.num_frames = num_frames
+        rng = np.random.default_rng(seed)
+        self.background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+        self.faces = []
+        if faces_dir and os.path.isdir(faces_dir):
+            for filename in sorted(os.listdir(faces_dir))[:num_faces]:
+                face = cv2.imread(os.path.join(faces_dir, filename))
+                if face is not None:
+                    self.faces.append(face)
+        self.starts = [(int(rng.integers(0, max(1, width - 300))), int(rng.integers(0, max(1, height - 300))))
+                       for _ in self.faces]
+
+    def read_frame(self, out=None):
+        if self.num_frames is not None and self.captured >= self.num_frames:
+            raise RuntimeError("End of synthetic stream.")
+        self._pace()
+        frame = out if out is not None and out.shape == self.background.shape else np.empty_like(self.background)
+        np.copyto(frame, self.background)
+        for face, (x0, y0) in zip(self.faces, self.starts):
+            h, w = face.shape[:2]
+            x = (x0 + 3 * self.captured) % max(1, self.width - w)
+            y = y0 % max(1, self.height - h)
+            frame[y:y + h, x:x + w] = face
+        self.captured += 1
+        self.delivered += 1
+        return frame
+
+    def skip_frame(self):
+        if self.num_frames is not None and self.captured >= self.num_frames:
+            raise RuntimeError("End of synthetic stream.")
+        self._pace()
+        self.captured += 1
+
+    def release(self):
+        pass
@@ -0,0 +1,147 @@
+# harvester.py
+# Live target packaging: stands in for FaceWorker (run.py live --package) and saves the face crops coming out of
+# DetectWorker into config.OUTPUT_DIR as training material, the live counterpart of FacePackager. Near-duplicates are
+# dropped with a difference hash, saving is rate limited, and the jpg writes happen on their own thread.
+
+import os
+import threading
+import time
+from queue import Queue, Empty, Full
+import cv2
+import numpy as np
+
+import config
+from workers import WorkerBase
+from metrics import REGISTRY as metrics
+
+
+def dhash(image, hash_size=8):
+    """
+    64-bit difference hash: shrink to (hash_size + 1) x hash_size grayscale and record whether each pixel is brighter
+    than its right-hand neighbour. Survives small shifts, rescaling and lighting changes, so the same face a frame or
+    two later hashes within a few bits of itself.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+class HashIndex:
+    """
+    The dHashes of every crop kept so far. nearest() is a vectorized Hamming distance over all of them, which for
+    the few thousand crops a training set has is far cheaper than anything fancier.
+    """
+    def __init__(self):
+        self.hashes = np.empty(0, dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def nearest(self, h):
+        if not len(self.hashes):
+            return 64
+        xor = np.bitwise_xor(self.hashes, np.uint64(h))
+        return int(np.unpackbits(xor.view(np.uint8)).reshape(len(xor), 64).sum(axis=1).min())
+
+    def add(self, h):
+        self.hashes = np.append(self.hashes, np.uint64(h))
+
+
+class FaceHarvester(WorkerBase):
+    """
+    Reads FaceWorker's input (face crop payloads) and keeps a crop only if its dHash is more than max_distance bits
+    away from every crop already kept (including whatever was in output_dir at startup) and the rate limiter has a
+    token for it: a bucket of burst tokens refilled at rate per second. Kept crops go to the writer thread through a
+    bounded queue, so a slow disk drops crops instead of backing up detection.
+    """
+    IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+    def __init__(self, input_queue, stop_event, name="FaceHarvester", output_dir=None, max_distance=None,
+                 rate=None, burst=None, max_crops=None):
+        self.output_dir = output_dir or config.OUTPUT_DIR
+        self.max_distance = config.HARVEST_HASH_DISTANCE if max_distance is None else max_distance
+        self.rate = rate or config.HARVEST_RATE
+        self.burst = burst or config.HARVEST_BURST
+        self.max_crops = config.HARVEST_MAX_CROPS if max_crops is None else max_crops
+        self.index = HashIndex()
+        self.tokens = float(self.burst)
+        self.last_refill = time.monotonic()
+        self.write_queue = Queue(maxsize=config.HARVEST_WRITE_QUEUE)
+        self.writer = threading.Thread(target=self._write_loop, daemon=True, name=f"{name}-writer")
+        # seen, kept, near duplicates, rate limited, write queue full
+        self.counts = {"seen": 0, "kept": 0, "duplicate": 0, "rate_limited": 0, "dropped": 0}
+        super().__init__(input_queue, stop_event, name, batch_size=config.FACE_BATCH_SIZE)
+
+    def load_model(self):
+        # "Model" here is the index of what's already on disk, so a restart doesn't save the same faces again.
+        os.makedirs(self.output_dir, exist_ok=True)
+        for filename in sorted(os.listdir(self.output_dir)):
+            if filename.startswith(".") or not filename.lower().endswith(self.IMAGE_EXTENSIONS):
+                continue
+            image = cv2.imread(os.path.join(self.output_dir, filename))
+            if image is not None:
+                self.index.add(dhash(image))
+        print(f"[{self.name}] {len(self.index)} existing crops in {self.output_dir} indexed.")
+
+    def run(self):
+        self.writer.start()
+        super().run()
+        self.write_queue.put(None)
+        self.writer.join()
+        counts = self.counts
+        print(f"[{self.name}] {counts['seen']} faces seen: {counts['kept']} saved, {counts['duplicate']} near-duplicates, "
+              f"{counts['rate_limited']} rate limited, {counts['dropped']} dropped by a full write queue")
+
+    def process_frame(self, payload):
+        self.counts["seen"] += 1
+        if self.max_crops is not None and self.counts["kept"] >= self.max_crops:
+            return
+        face = payload["face"]
+        h = dhash(face)
+        if self.index.nearest(h) <= self.max_distance:
+            self.counts["duplicate"] += 1
+            metrics.inc("harvest_total", outcome="duplicate")
+            return
+        if not self._take_token():
+            # Not added to the index, so a similar crop can still be saved once there are tokens again.
+            self.counts["rate_limited"] += 1
+            metrics.inc("harvest_total", outcome="rate_limited")
+            return
+        filename = f"live_{time.strftime('%Y%m%d_%H%M%S')}_{h:016x}.jpg"
+        try:
+            self.write_queue.put_nowait((filename, face))
+        except Full:
+            self.counts["dropped"] += 1
+            metrics.inc("harvest_total", outcome="dropped")
+            return
+        self.index.add(h)
+        self.counts["kept"] += 1
+        metrics.inc("harvest_total", outcome="kept")
+
+    def _take_token(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+    def _write_loop(self):
+        while True:
+            try:
+                item = self.write_queue.get(timeout=0.5)
+            except Empty:
+                continue
+            if item is None:
+                return
+            filename, face = item
+            path = os.path.join(self.output_dir, filename)
+            # Write under a dot-name (which the packager, cache and index all skip) and rename into place, so
+            # nothing ever picks up a half-written jpg.
+            tmp_path = os.path.join(self.output_dir, "." + filename)
+            if cv2.imwrite(tmp_path, face):
+                os.replace(tmp_path, path)
+            else:
+                print(f"[{self.name}] Warning: failed to write {path}")
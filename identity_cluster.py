@@ -0,0 +1,263 @@
+# identity_cluster.py
+# Finds the one person common to a set of multi-person photos. Every face crop FacePackager cut out gets a compact
+# LBP histogram descriptor; SimHash (random hyperplane) buckets propose candidate neighbours so no crop is compared
+# against more than a bucket's worth of others; crops that are in each other's top-k get linked; union-find turns
+# the links into clusters; and the cluster spanning the most distinct source photos is the target.
+
+import os
+import re
+import json
+import numpy as np
+
+import config
+from face_cache import FaceCache
+
+# 8 neighbours at radius 1, clockwise from the top-left, as (row, col) offsets.
+_NEIGHBOURS = ((-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1))
+
+
+def _uniform_table():
+    # "Uniform" patterns (at most two 0/1 transitions around the circle) each get their own bin, the rest share one:
+    # 58 + 1 = 59 bins instead of 256, with almost none of the information lost.
+    table = np.full(256, 58, dtype=np.uint8)
+    next_bin = 0
+    for code in range(256):
+        bits = [(code >> i) & 1 for i in range(8)]
+        if sum(bits[i] != bits[(i + 1) % 8] for i in range(8)) <= 2:
+            table[code] = next_bin
+            next_bin += 1
+    return table
+
+
+UNIFORM_TABLE = _uniform_table()
+UNIFORM_BINS = 59
+
+
+def lbp_descriptors(faces, grid=(4, 4), chunk=256):
+    """
+    (N, height, width) uint8 faces -> (N, grid_rows * grid_cols * 59) float32 descriptors: uniform LBP histograms per
+    grid cell, concatenated, square-rooted and L2-normalized (Hellinger), so a dot product is a similarity in [0, 1].
+    Works through the faces chunk at a time to keep the intermediate arrays small.
+    """
+    n, height, width = faces.shape
+    rows, cols = grid
+    out = np.empty((n, rows * cols * UNIFORM_BINS), dtype=np.float32)
+    # Cell boundaries over the (height - 2, width - 2) interior where all 8 neighbours exist.
+    row_edges = np.linspace(0, height - 2, rows + 1).astype(int)
+    col_edges = np.linspace(0, width - 2, cols + 1).astype(int)
+    for start in range(0, n, chunk):
+        block = np.asarray(faces[start:start + chunk])
+        center = block[:, 1:-1, 1:-1]
+        codes = np.zeros(center.shape, dtype=np.uint8)
+        for bit, (dy, dx) in enumerate(_NEIGHBOURS):
+            neighbour = block[:, 1 + dy:height - 1 + dy, 1 + dx:width - 1 + dx]
+            codes |= (neighbour >= center).astype(np.uint8) << bit
+        codes = UNIFORM_TABLE[codes]
+        m = len(block)
+        hists = []
+        for r in range(rows):
+            for c in range(cols):
+                cell = codes[:, row_edges[r]:row_edges[r + 1], col_edges[c]:col_edges[c + 1]].reshape(m, -1)
+                # Offset each face's codes into its own range so one bincount does the whole block.
+                counts = np.bincount((cell + UNIFORM_BINS * np.arange(m)[:, None]).ravel(), minlength=m * UNIFORM_BINS)
+                hists.append(counts.reshape(m, UNIFORM_BINS))
+        desc = np.sqrt(np.concatenate(hists, axis=1).astype(np.float32))
+        out[start:start + m] = desc / np.maximum(np.linalg.norm(desc, axis=1, keepdims=True), 1e-12)
+    return out
+
+
+def simhash_buckets(descriptors, tables=8, bits=10, max_bucket=64, seed=0):
+    """
+    Yields arrays of row indices that landed in the same bucket of one of the hash tables. Each table hashes a
+    descriptor to the sign pattern of bits random projections (after centering, so the signs actually split the
+    data). Buckets bigger than max_bucket are ordered along one more projection and cut into max_bucket windows, which
+    keeps the comparisons per crop bounded however lopsided the data is.
+    """
+    rng = np.random.default_rng(seed)
+    centered = descriptors - descriptors.mean(axis=0)  # no-op for centered input, but the signs need it otherwise
+    weights = 1 << np.arange(bits, dtype=np.int64)
+    for _ in range(tables):
+        planes = rng.standard_normal((descriptors.shape[1], bits)).astype(np.float32)
+        keys = ((centered @ planes) > 0).astype(np.int64) @ weights
+        order = np.argsort(keys, kind="stable")
+        boundaries = np.flatnonzero(np.diff(keys[order])) + 1
+        line = centered @ rng.standard_normal(descriptors.shape[1]).astype(np.float32)
+        for bucket in np.split(order, boundaries):
+            if len(bucket) < 2:
+                continue
+            if len(bucket) > max_bucket:
+                bucket = bucket[np.argsort(line[bucket])]
+                for i in range(0, len(bucket), max_bucket):
+                    if len(bucket[i:i + max_bucket]) > 1:
+                        yield bucket[i:i + max_bucket]
+            else:
+                yield bucket
+
+
+def mutual_neighbour_links(descriptors, groups, k=5, min_similarity=0.1, tables=8, bits=10, max_bucket=64, seed=0):
+    """
+    Returns (i, j, similarity) arrays of pairs that are each other's top-k neighbours among the LSH candidates, at or
+    above min_similarity, and from different source images (two crops of the same photo are two different people).
+    """
+    groups = np.asarray(groups)
+    cand_i, cand_j, cand_s = [], [], []
+    for bucket in simhash_buckets(descriptors, tables, bits, max_bucket, seed):
+        sims = descriptors[bucket] @ descriptors[bucket].T
+        sims[groups[bucket][:, None] == groups[bucket][None, :]] = -1.0  # also blanks the diagonal
+        top = min(k, len(bucket) - 1)
+        best = np.argpartition(-sims, top - 1, axis=1)[:, :top]
+        rows = np.repeat(np.arange(len(bucket)), top)
+        s = sims[rows, best.ravel()]
+        keep = s >= min_similarity
+        cand_i.append(bucket[rows[keep]])
+        cand_j.append(bucket[best.ravel()[keep]])
+        cand_s.append(s[keep])
+    if not cand_i:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+    i, j, s = np.concatenate(cand_i), np.concatenate(cand_j), np.concatenate(cand_s)
+
+    # The same pair can come out of several tables; keep each (i, j) once, then each i's k most similar.
+    order = np.lexsort((-s, j, i))
+    i, j, s = i[order], j[order], s[order]
+    first = np.ones(len(i), dtype=bool)
+    first[1:] = (i[1:] != i[:-1]) | (j[1:] != j[:-1])
+    i, j, s = i[first], j[first], s[first]
+    order = np.lexsort((-s, i))
+    i, j, s = i[order], j[order], s[order]
+    starts = np.flatnonzero(np.r_[True, i[1:] != i[:-1]])
+    rank = np.arange(len(i)) - np.repeat(starts, np.diff(np.r_[starts, len(i)]))
+    topk = rank < k
+    i, j, s = i[topk], j[topk], s[topk]
+
+    # Mutual: (i, j) survives only if (j, i) is also in somebody's top k.
+    n = len(descriptors)
+    forward = i * n + j
+    mutual = np.isin(forward, j * n + i) & (i < j)
+    return i[mutual], j[mutual], s[mutual]
+
+
+class UnionFind:
+    """
+    Union-find over crops that also tracks which source images each cluster covers, and refuses to merge two clusters
+    that share one: the same person can't be in a photo twice, so such a merge would be two people being chained
+    together. Sets are merged smaller into larger, so the bookkeeping stays near-linear overall.
+    """
+    def __init__(self, groups):
+        self.parent = np.arange(len(groups))
+        self.groups = [{g} for g in groups]
+
+    def find(self, x):
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return True
+        if not self.groups[ra].isdisjoint(self.groups[rb]):
+            return False
+        if len(self.groups[ra]) < len(self.groups[rb]):
+            ra, rb = rb, ra
+        self.parent[rb] = ra
+        self.groups[ra] |= self.groups[rb]
+        self.groups[rb] = None
+        return True
+
+    def labels(self):
+        return np.array([self.find(x) for x in range(len(self.parent))])
+
+
+def source_groups(folder, names):
+    """
+    Which source photo each crop came from: FacePackager's manifest if there is one, otherwise the source hash in a
+    face_<hash>_<k>.jpg name, otherwise the crop is taken to be its own photo (e.g. live harvested crops).
+    """
+    crop_source = {}
+    manifest_path = os.path.join(folder, ".manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            for content_hash, entry in json.load(f).get("images", {}).items():
+                for crop in entry["crops"]:
+                    crop_source[crop] = content_hash
+    groups = []
+    for name in names:
+        match = re.match(r"face_([0-9a-f]{12})_\d+\.", name)
+        groups.append(crop_source.get(name) or (match.group(1) if match else name))
+    return groups
+
+
+def find_common_identity(descriptors, groups, k=None, min_similarity=None, tables=None, bits=None, max_bucket=None):
+    """
+    Returns (members, stats): the row indices of the cluster covering the most distinct source images (ties go to
+    the bigger cluster), and a few numbers about the clustering for the report.
+    """
+    k = k or config.CLUSTER_NEIGHBORS
+    min_similarity = config.CLUSTER_MIN_SIMILARITY if min_similarity is None else min_similarity
+    tables = tables or config.CLUSTER_LSH_TABLES
+    bits = bits or config.CLUSTER_LSH_BITS
+    max_bucket = max_bucket or config.CLUSTER_MAX_BUCKET
+
+    n = len(descriptors)
+    if n == 0:
+        return np.empty(0, np.int64), {"crops": 0, "links": 0, "clusters": 0}
+    if not bits:
+        # Enough bits that buckets come out around a quarter of max_bucket on average.
+        bits = max(1, int(np.ceil(np.log2(max(1.0, 4 * n / max_bucket)))))
+    # Face LBP histograms all look alike (cosine around 0.9 between strangers); what tells people apart is how each
+    # one differs from the average face of the collection.
+    descriptors = descriptors - descriptors.mean(axis=0)
+    descriptors /= np.maximum(np.linalg.norm(descriptors, axis=1, keepdims=True), 1e-12)
+    i, j, s = mutual_neighbour_links(descriptors, groups, k, min_similarity, tables, bits, max_bucket)
+    # Strongest links first, so when two merges conflict it's the weaker one that gets refused.
+    order = np.argsort(-s, kind="stable")
+    uf = UnionFind(list(groups))
+    refused = sum(not uf.union(a, b) for a, b in zip(i[order].tolist(), j[order].tolist()))
+    labels = uf.labels()
+
+    groups = np.asarray(groups)
+    best_label, best_score = None, None
+    for label in np.unique(labels):
+        members = np.flatnonzero(labels == label)
+        score = (len(np.unique(groups[members])), len(members))
+        if best_score is None or score > best_score:
+            best_label, best_score = label, score
+    members = np.flatnonzero(labels == best_label)
+    stats = {
+        "crops": int(n),
+        "source_images": int(len(np.unique(groups))),
+        "links": int(len(i)),
+        "refused_links": int(refused),
+        "clusters": int(len(np.unique(labels))),
+        "selected_crops": int(len(members)),
+        "selected_images": int(best_score[0]),
+    }
+    return members, stats
+
+
+def cluster_folder(folder, face_size=(150, 150), report_path=None):
+    """
+    Clusters the crops in folder (loaded through its FaceCache) and returns the file names of the common identity,
+    for FaceTrainer(train_names=...). Writes a report of the pick to report_path. Raises RuntimeError if no
+    cluster spans at least two source images (including an empty folder).
+    """
+    report_path = report_path or config.CLUSTER_REPORT_PATH
+    faces, names = FaceCache(folder, face_size).load()
+    groups = source_groups(folder, names)
+    members, stats = find_common_identity(lbp_descriptors(faces), groups)
+    selected = [names[i] for i in members]
+    matched = stats.get("selected_images", 0) >= 2
+    print(f"[CLUSTER] {stats['crops']} crops from {stats.get('source_images', 0)} images: picked {len(selected)} crops "
+          f"spanning {stats.get('selected_images', 0)} images ({stats['links']} links, {stats['clusters']} clusters)")
+    with open(report_path, "w") as f:
+        json.dump(dict(stats, folder=folder, selected=selected if matched else []), f, indent=1)
+    print(f"[CLUSTER] Report written to {report_path}")
+    # A "cluster" in one image is just whichever crop won the tie; training the target model on it would be
+    # training on a random face.
+    if not matched:
+        raise RuntimeError(f"No face in {folder} matched across two or more source images, so there is no common "
+                           f"identity to train on. Add more photos of the target or lower CLUSTER_MIN_SIMILARITY.")
+    return selected
@@ -0,0 +1,221 @@
+# metrics.py
+# Lightweight in-process metrics for the live pipeline: counters, histograms and gauges, rendered as Prometheus text
+# (served over a small local HTTP endpoint) or dumped as JSON. Stages record into the module-level REGISTRY the
+# same way they read settings off config, so nothing has to be threaded through constructors.
+#
+# Only covers the current process - DetectProcessPool replicas don't report their internals here.
+
+import os
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "recaller_"
+# Seconds. Spans sub-millisecond decode work up to multi-second stalls.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q):
+        # Upper bound of the bucket the q-th observation falls in; good enough to see where frames go.
+        if not self.count:
+            return None
+        target = q * self.count
+        running = 0
+        for bound, n in zip(self.buckets, self.counts):
+            running += n
+            if running >= target:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}    # name -> {label key: value}
+        self.histograms = {}  # name -> {label key: _Histogram}
+        self.gauges = {}      # name -> {label key: callable}
+        self.help = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1, help=None, **labels):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+            if help:
+                self.help.setdefault(name, help)
+
+    def observe(self, name, value, help=None, **labels):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            key = _label_key(labels)
+            if key not in series:
+                series[key] = _Histogram(self.buckets)
+            series[key].observe(value)
+            if help:
+                self.help.setdefault(name, help)
+
+    def gauge(self, name, fn, help=None, **labels):
+        """
+        Registers fn (no arguments, returns a number) to be read whenever metrics are rendered.
+        """
+        with self.lock:
+            self.gauges.setdefault(name, {})[_label_key(labels)] = fn
+            if help:
+                self.help.setdefault(name, help)
+
+    def timer(self, name, **labels):
+        return _Timer(self, name, labels)
+
+    def render_prometheus(self):
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                self._header(lines, name, "counter")
+                for key, value in series.items():
+                    lines.append(f"{PREFIX}{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self.gauges.items()):
+                self._header(lines, name, "gauge")
+                for key, fn in series.items():
+                    lines.append(f"{PREFIX}{name}{_format_labels(key)} {_read_gauge(fn)}")
+            for name, series in sorted(self.histograms.items()):
+                self._header(lines, name, "histogram")
+                for key, hist in series.items():
+                    running = 0
+                    for bound, n in zip(hist.buckets, hist.counts):
+                        running += n
+                        lines.append(f"{PREFIX}{name}_bucket{_format_labels(key, [('le', bound)])} {running}")
+                    lines.append(f"{PREFIX}{name}_bucket{_format_labels(key, [('le', '+Inf')])} {hist.count}")
+                    lines.append(f"{PREFIX}{name}_sum{_format_labels(key)} {hist.sum}")
+                    lines.append(f"{PREFIX}{name}_count{_format_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines, name, kind):
+        if name in self.help:
+            lines.append(f"# HELP {PREFIX}{name} {self.help[name]}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    def snapshot(self):
+        """
+        Plain dict version for JSON dumps: counters and gauges as values, histograms as count/mean/p50/p95/p99.
+        """
+        def series_name(name, key):
+            return name + _format_labels(key)
+
+        with self.lock:
+            snap = {"uptime_seconds": time.time() - self.started, "counters": {}, "gauges": {}, "histograms": {}}
+            for name, series in self.counters.items():
+                for key, value in series.items():
+                    snap["counters"][series_name(name, key)] = value
+            for name, series in self.gauges.items():
+                for key, fn in series.items():
+                    snap["gauges"][series_name(name, key)] = _read_gauge(fn)
+            for name, series in self.histograms.items():
+                for key, hist in series.items():
+                    snap["histograms"][series_name(name, key)] = {
+                        "count": hist.count,
+                        "mean": hist.sum / hist.count if hist.count else None,
+                        "p50": hist.quantile(0.5),
+                        "p95": hist.quantile(0.95),
+                        "p99": hist.quantile(0.99),
+                    }
+        return snap
+
+    def dump_json(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f, indent=1)
+        # Replace in one step so anything tailing the file never reads half a dump.
+        os.replace(tmp_path, path)
+
+
+def _read_gauge(fn):
+    try:
+        return fn()
+    except Exception:
+        return float("nan")
+
+
+class _Timer:
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class MetricsServer(threading.Thread):
+    """
+    Serves REGISTRY as Prometheus text on http://host:port/metrics (and JSON on /metrics.json).
+    """
+    def __init__(self, registry, port, host="127.0.0.1"):
+        super().__init__(daemon=True, name="MetricsServer")
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body = json.dumps(registry_ref.snapshot()).encode()
+                    content_type = "application/json"
+                elif self.path.startswith("/metrics"):
+                    body = registry_ref.render_prometheus().encode()
+                    content_type = "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # keep scrapes out of the console
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+
+    def run(self):
+        print(f"[Metrics] Serving on http://{self.server.server_address[0]}:{self.server.server_address[1]}/metrics")
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+REGISTRY = MetricsRegistry()
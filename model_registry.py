@@ -0,0 +1,100 @@
+# model_registry.py
+# Loads the models the pipeline needs once, in the background, so the workers don't each load (and warm up) their
+# own copy one after another on the coordinator thread. run_system kicks off the loads before it opens the cameras
+# and the workers pick up the finished models when they're constructed.
+#
+# cv2.dnn nets aren't safe to run from two threads at once, so nets aren't shared between workers: each preloaded
+# copy goes to exactly one taker, and anyone asking for more than was preloaded gets a fresh one loaded on the spot.
+
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+import config
+import dnn_backend
+
+
+class DarknetModel:
+    """
+    A loaded Darknet net plus its output layer names, ready to forward on the given backend/target.
+    """
+    def __init__(self, cfg_path, weights_path, warmup_size=416, backend=None, target=None):
+        self.net = cv2.dnn.readNetFromDarknet(cfg_path, weights_path)
+        dnn_backend.configure_net(self.net, backend, target)
+        layer_names = self.net.getLayerNames()
+        self.output_layers = [layer_names[i - 1] for i in self.net.getUnconnectedOutLayers()]
+        if warmup_size:
+            # The first forward allocates every layer's buffers and is several times slower than the rest; do it
+            # here, off the critical path, instead of on the first camera frame.
+            blank = np.zeros((warmup_size, warmup_size, 3), dtype=np.uint8)
+            self.net.setInput(cv2.dnn.blobFromImage(blank, 1/255.0, (warmup_size, warmup_size)))
+            self.net.forward(self.output_layers)
+
+
+def load_lbph(model_path):
+    recognizer = cv2.face.LBPHFaceRecognizer_create()
+    recognizer.read(model_path)
+    return recognizer
+
+
+class ModelRegistry:
+    """
+    preload_*() queue loads on a small thread pool and return straight away; the matching getters hand out a
+    preloaded copy (waiting for it to finish if need be) or load one synchronously if none is left.
+    Models are keyed by path and file mtime (and for nets, backend/target as set in config), so a model that changed on
+    disk or settings since it was preloaded isn't handed out.
+    load_times keeps how long each load took, for the startup report.
+    """
+    def __init__(self, max_workers=4):
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ModelLoad")
+        self.ready = defaultdict(deque)  # key -> futures of preloaded copies nobody has taken yet
+        self.load_times = {}
+
+    @staticmethod
+    def _key(kind, *paths):
+        return (kind,) + tuple((path, os.path.getmtime(path) if os.path.exists(path) else None) for path in paths)
+
+    def _timed(self, key, loader, *args):
+        start = time.perf_counter()
+        model = loader(*args)
+        with self.lock:
+            self.load_times.setdefault(key[0], []).append(time.perf_counter() - start)
+        return model
+
+    def _preload(self, key, copies, loader, *args):
+        with self.lock:
+            for _ in range(copies):
+                self.ready[key].append(self.pool.submit(self._timed, key, loader, *args))
+
+    def _take(self, key, loader, *args):
+        with self.lock:
+            future = self.ready[key].popleft() if self.ready[key] else None
+        if future is not None:
+            return future.result()
+        return self._timed(key, loader, *args)
+
+    def _darknet_key(self, cfg_path, weights_path):
+        return self._key("darknet", cfg_path, weights_path) + (config.DNN_BACKEND, config.DNN_TARGET)
+
+    def preload_darknet(self, cfg_path, weights_path, copies=1, warmup_size=None):
+        warmup_size = warmup_size or config.DETECT_INPUT_SIZE
+        self._preload(self._darknet_key(cfg_path, weights_path), copies, DarknetModel, cfg_path, weights_path, warmup_size)
+
+    def darknet(self, cfg_path, weights_path, warmup_size=None):
+        warmup_size = warmup_size or config.DETECT_INPUT_SIZE
+        return self._take(self._darknet_key(cfg_path, weights_path), DarknetModel, cfg_path, weights_path, warmup_size)
+
+    def preload_lbph(self, model_path, copies=1):
+        if os.path.exists(model_path):
+            self._preload(self._key("lbph", model_path), copies, load_lbph, model_path)
+
+    def lbph(self, model_path):
+        return self._take(self._key("lbph", model_path), load_lbph, model_path)
+
+
+MODELS = ModelRegistry()
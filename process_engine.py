@@ -0,0 +1,216 @@
+# process_engine.py
+# Optional multiprocess detection engine. Runs K DetectWorker replicas in their own processes (each with its own
+# cv2.dnn net) so NMS, cropping and resizing stop fighting the producer for the GIL.
+
+import threading
+import time
+import multiprocessing as mp
+from collections import deque
+from queue import Empty, Full
+
+import config
+import dnn_backend
+from workers import DetectWorker
+from result_sink import publish
+from metrics import REGISTRY as metrics
+
+
+class DetectReplica(DetectWorker):
+    """
+    A DetectWorker that lives in a child process. Instead of pushing single faces on to the face queue it sends back
+    one result per frame, so the parent can put frames back in order. Errors still produce an (empty) result,
+    otherwise the parent would sit waiting on a frame_id that is never coming.
+    """
+    def __init__(self, task_queue, stop_event, result_queue, name="DetectReplica", frame_ring=None):
+        self.result_queue = result_queue
+        self._results = []
+        super().__init__(task_queue, stop_event, face_output_queue=None, name=name, frame_ring=frame_ring)
+
+    def process_batch(self, payloads):
+        self._results = []
+        try:
+            super().process_batch(payloads)
+        except Exception as e:
+            print(f"[{self.name}] Error: {e}")
+            done = {(result["source_id"], result["frame_id"]) for result in self._results}
+            for payload in payloads:
+                if (payload.get("source_id"), payload["frame_id"]) not in done:
+                    self.emit_faces(payload, [], [])
+        # Results go back after the batch so they carry this replica's up to date service time.
+        for result in self._results:
+            result["service_time"] = self.service_time
+            self.result_queue.put(result)
+
+    def emit_faces(self, payload, faces, boxes):
+        self._results.append({
+            "frame_id": payload["frame_id"],
+            "source_id": payload.get("source_id"),
+            "timestamp": payload["timestamp"],
+            "faces": faces,
+            "boxes": boxes,
+        })
+
+
+def _replica_main(index, task_queue, result_queue, stop_event, frame_ring, dnn_settings):
+    # Runs in the child. The replica is a Thread subclass but we just call run() on the process' main thread.
+    # The child imports a fresh config, so the parent's backend/input size settings (profile, CLI) come along explicitly.
+    dnn_backend.apply_settings(dnn_settings)
+    # Don't let unread results keep the child hanging around at shutdown.
+    result_queue.cancel_join_thread()
+    replica = DetectReplica(task_queue, stop_event, result_queue, name=f"DetectReplica-{index}", frame_ring=frame_ring)
+    replica.run()
+    if frame_ring is not None:
+        frame_ring.close()
+
+
+class DetectProcessPool(threading.Thread):
+    """
+    Drop-in replacement for DetectWorker in run_system: reads the same detect queue and feeds the same face queue.
+    Frames are handed out round-robin to the replicas, but only to a replica that has sent back its last result: a
+    frame stays in the (latest-wins) detect queue until some replica is free for it, so it can still be evicted by a
+    newer one instead of going stale in a queue in front of a busy replica. Results are put back on the face queue in
+    the order the frames were dispatched (frames are keyed by (source_id, frame_id), frame_ids are only unique per
+    camera).
+    With a frame_ring only slot indices cross the process boundary; the replica that
+    gets a frame releases its slot. service_time is the replicas' per-frame busy time divided across the pool,
+    i.e. what the producer's adaptive sampling should plan around.
+    """
+    def __init__(self, input_queue, stop_event, face_output_queue, num_processes=None, name="DetectPool", frame_ring=None,
+                 sink_queue=None):
+        super().__init__(daemon=True, name=name)
+        self.queue = input_queue
+        self.sink_queue = sink_queue
+        self.stop_event = stop_event
+        self.face_output_queue = face_output_queue
+        self.name = name
+        self.num_processes = num_processes or config.DETECT_PROCESSES
+
+        # spawn rather than fork: we already have camera and worker threads running by the time this starts.
+        ctx = mp.get_context("spawn")
+        self.child_stop = ctx.Event()
+        # A replica only ever has one frame dispatched to it at a time, so its task queue never needs more.
+        self.task_queues = [ctx.Queue(maxsize=1) for _ in range(self.num_processes)]
+        self.result_queue = ctx.Queue()
+        self.processes = [
+            ctx.Process(target=_replica_main, args=(i, q, self.result_queue, self.child_stop, frame_ring,
+                                                           dnn_backend.current_settings()), daemon=True)
+            for i, q in enumerate(self.task_queues)
+        ]
+
+        # (source_id, frame_id) keys in dispatch order, and results that came back ahead of their turn
+        self.pending = deque()
+        self.pending_lock = threading.Condition()  # also signalled whenever a replica frees up
+        self.finished = {}
+        self.assigned = {}  # (source_id, frame_id) -> replica working on it
+        self.busy = [False] * self.num_processes
+        self.service_time = 0.0
+        self.faces_dropped = 0
+        self.first_result_at = None
+        self.collector = threading.Thread(target=self._collect_results, daemon=True, name=f"{name}-collector")
+
+    def run(self):
+        print(f"[{self.name}] Starting {self.num_processes} detection processes.")
+        for p in self.processes:
+            p.start()
+        self.collector.start()
+
+        next_replica = 0
+        while not self.stop_event.is_set():
+            for p in self.processes:
+                if not p.is_alive():
+                    self._shutdown()
+                    raise RuntimeError(f"{p.name} exited with code {p.exitcode}.")
+            replica = self._idle_replica(next_replica)
+            if replica is None:
+                continue
+            try:
+                payload = self.queue.get(timeout=0.1)
+            except Empty:
+                continue
+
+            key = (payload.get("source_id"), payload["frame_id"])
+            with self.pending_lock:
+                self.pending.append(key)
+                self.assigned[key] = replica
+                self.busy[replica] = True
+            task_queue = self.task_queues[replica]
+            next_replica = (replica + 1) % self.num_processes
+            while not self.stop_event.is_set():
+                try:
+                    task_queue.put(payload, timeout=0.1)
+                    break
+                except Full:
+                    continue
+
+        self._shutdown()
+        if self.faces_dropped:
+            print(f"[{self.name}] {self.faces_dropped} faces dropped by a full face queue")
+        print(f"[{self.name}] Stopped.")
+
+    def _idle_replica(self, start):
+        # First free replica from start on in round-robin order; waits a little for one if they're all busy.
+        with self.pending_lock:
+            for _ in range(2):
+                for offset in range(self.num_processes):
+                    replica = (start + offset) % self.num_processes
+                    if not self.busy[replica]:
+                        return replica
+                self.pending_lock.wait(timeout=0.1)
+        return None
+
+    def _release_replica(self, key):
+        # Caller holds pending_lock.
+        replica = self.assigned.pop(key, None)
+        if replica is not None:
+            self.busy[replica] = False
+            self.pending_lock.notify()
+
+    def _collect_results(self):
+        while not self.child_stop.is_set():
+            try:
+                result = self.result_queue.get(timeout=0.1)
+            except Empty:
+                continue
+            key = (result["source_id"], result["frame_id"])
+            if self.first_result_at is None:
+                self.first_result_at = time.time()
+            self.service_time = result["service_time"] / self.num_processes
+
+            with self.pending_lock:
+                self.finished[key] = result
+                self._release_replica(key)
+                # If a replica lost a frame somehow, don't hold everything else hostage behind it forever.
+                if self.pending and len(self.finished) > 4 * self.num_processes and self.pending[0] not in self.finished:
+                    print(f"[{self.name}] Warning: frame {self.pending[0][1]} never came back, skipping it.")
+                    self._release_replica(self.pending.popleft())
+                ready = []
+                while self.pending and self.pending[0] in self.finished:
+                    ready.append(self.finished.pop(self.pending.popleft()))
+
+            for result in ready:
+                publish(self.sink_queue, {
+                    "frame_id": result["frame_id"],
+                    "source_id": result["source_id"],
+                    "timestamp": result["timestamp"],
+                    "boxes": result["boxes"],
+                })
+                for face, box in zip(result["faces"], result["boxes"]):
+                    try:
+                        self.face_output_queue.put_nowait({
+                            "frame_id": result["frame_id"],
+                            "source_id": result["source_id"],
+                            "timestamp": result["timestamp"],
+                            "box": box,
+                            "face": face,
+                            "enqueued_at": time.time(),
+                        })
+                    except Full:
+                        self.faces_dropped += 1
+                        metrics.inc("dropped_total", where="face_queue")
+
+    def _shutdown(self):
+        self.child_stop.set()
+        for p in self.processes:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
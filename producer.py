@@ -1,43 +1,180 @@
 import threading
 import time
-from queue import Queue, Full
+from queue import Queue, Full, Empty
 from camera_stream import CameraStream
+import config
+from metrics import REGISTRY as metrics
+
+
+class FrameScheduler:
+    """
+    Decides which camera frames the producer actually pushes.
+    "stride":   push every interval-th frame (1 = every frame).
+    "time":     push at most one frame every interval seconds.
+    "adaptive": like "time", but the interval follows the detect stage. load_probe() should return
+                (seconds per frame the detector needs, frames currently queued for it); the interval is steered
+                towards service_time * (1 + queue depth) and clamped to [min_interval, max_interval].
+    max_fps caps the push rate on top of whichever mode is in use (a per-camera frame budget).
+    """
+    def __init__(self, mode="stride", interval=1, load_probe=None, min_interval=0.0, max_interval=1.0, smoothing=0.2,
+                 max_fps=None):
+        if mode not in ("stride", "time", "adaptive"):
+            raise ValueError(f"Unknown frame sampling mode: {mode}")
+        self.mode = mode
+        self.interval = interval
+        self.load_probe = load_probe
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.smoothing = smoothing
+        self.current_interval = min_interval if mode == "adaptive" else interval
+        self.min_gap = 1.0 / max_fps if max_fps else 0.0
+        self._since_last = 0
+        self._next_due = 0.0
+        self._budget_due = 0.0
+
+    def due(self):
+        now = time.monotonic()
+        if now < self._budget_due:
+            return False
+        if self.mode == "stride":
+            return self._since_last + 1 >= self.interval
+        return now >= self._next_due
+
+    def time_until_due(self):
+        budget_wait = max(0.0, self._budget_due - time.monotonic())
+        if self.mode == "stride":
+            return budget_wait
+        return max(budget_wait, self._next_due - time.monotonic())
+
+    def skipped(self):
+        self._since_last += 1
+
+    def emitted(self):
+        self._since_last = 0
+        if self.mode == "adaptive" and self.load_probe is not None:
+            service_time, depth = self.load_probe()
+            target = min(self.max_interval, max(self.min_interval, service_time * (1 + depth)))
+            self.current_interval += self.smoothing * (target - self.current_interval)
+        if self.mode != "stride":
+            self._next_due = time.monotonic() + self.current_interval
+        if self.min_gap:
+            self._budget_due = time.monotonic() + self.min_gap
+
 
 class FrameProducer(threading.Thread):
-    def __init__(self, camera: CameraStream, output_queues: list, stop_event: threading.Event, drop_old=True):
+    """
+    Reads frames off the camera and pushes them to every output queue.
+    With a frame_ring the frame is decoded straight into a shared memory slot and the queues only get the slot
+    index, frame_id and timestamp. Any slot we evict from a queue (or fail to queue) is released on behalf of
+    the consumer that will now never see it.
+    Queues that support put_latest() (frame_queue.LatestQueue) get atomic latest-wins puts and per-consumer
+    counters, see stats().
+    Which frames get pushed at all is up to the scheduler (a FrameScheduler built from config by default).
+    Every payload is tagged with source_id so workers shared between several cameras know where it came from.
+    """
+    def __init__(self, camera: CameraStream, output_queues: list, stop_event: threading.Event, drop_old=True, frame_ring=None,
+                 scheduler=None, source_id=None):
         super().__init__(daemon=True)
+        self.source_id = source_id if source_id is not None else camera.cam_index
+        self.tag = "[Producer]" if source_id is None else f"[Producer {self.source_id}]"
         self.camera = camera
         self.queues = output_queues
         self.stop_event = stop_event
         self.drop_old = drop_old
+        self.frame_ring = frame_ring
+        self.scheduler = scheduler or FrameScheduler(config.FRAME_SAMPLING, config.FRAME_INTERVAL)
         self.frame_id = 0
+        self.skipped = 0
+        self.ring_dropped = 0
 
     def run(self):
-        print("[Producer] Starting frame capture.")
+        print(f"{self.tag} Starting frame capture.")
         while not self.stop_event.is_set():
+            slot = None
             try:
-                frame = self.camera.read_frame()
+                if not self._wait_for_next_frame():
+                    break
+                if self.frame_ring is not None:
+                    slot = self.frame_ring.acquire()
+                    if slot is None:
+                        # Every slot is still held by a slow consumer; read and throw this one away.
+                        self.camera.read_frame()
+                        # Counted, not printed: this happens once per frame exactly when the system is overloaded.
+                        self.ring_dropped += 1
+                        metrics.inc("dropped_total", where="frame_ring")
+                        continue
+                    frame = self.camera.read_frame(out=self.frame_ring.view(slot))
+                    if frame.shape != self.frame_ring.frame_shape:
+                        raise RuntimeError(f"Camera frame shape {frame.shape} does not match the frame ring.")
+                else:
+                    frame = self.camera.read_frame()
             except RuntimeError as e:
-                print(f"[Producer] Error reading frame: {e}")
+                print(f"{self.tag} Error reading frame: {e}")
+                if slot is not None:
+                    for _ in self.queues:
+                        self.frame_ring.release(slot)
                 break
 
             timestamp = time.time()
             payload = {
-                "frame": frame,
                 "timestamp": timestamp,
                 "frame_id": self.frame_id,
+                "source_id": self.source_id,
             }
+            if slot is not None:
+                payload["slot"] = slot
+            else:
+                payload["frame"] = frame
             self.frame_id += 1
+            self.scheduler.emitted()
+            metrics.inc("frames_produced_total", source=self.source_id)
 
             for q in self.queues:
+                if self.drop_old and hasattr(q, "put_latest"):
+                    evicted = q.put_latest(payload)
+                    if evicted is not None:
+                        self._release(evicted)
+                        metrics.inc("dropped_total", where=getattr(q, "name", "queue"))
+                    continue
                 try:
                     if self.drop_old and q.full():
                         try:
-                            q.get_nowait()
-                        except:
+                            self._release(q.get_nowait())
+                            metrics.inc("dropped_total", where=getattr(q, "name", "queue"))
+                        except Empty:
                             pass
                     q.put_nowait(payload)
                 except Full:
-                    print("[Producer] Warning: Queue full, frame dropped.")
+                    self._release(payload)
+                    metrics.inc("dropped_total", where=getattr(q, "name", "queue"))
+
+        print(f"{self.tag} Stopped.")
+
+    def _wait_for_next_frame(self):
+        # Frames we aren't going to push are only grabbed, not decoded or copied, but we do keep pulling them
+        # so the driver buffer doesn't hand us a stale one when the next frame is due. A threaded camera is
+        # already doing that on its own, so in time-based modes we can just sleep.
+        while not self.stop_event.is_set():
+            if self.scheduler.due():
+                return True
+            if self.scheduler.mode != "stride" and getattr(self.camera, "threaded", False):
+                self.stop_event.wait(min(self.scheduler.time_until_due(), 0.05))
+            else:
+                self.camera.skip_frame()
+                self.scheduler.skipped()
+                self.skipped += 1
+                metrics.inc("frames_skipped_total", source=self.source_id)
+        return False
+
+    def stats(self):
+        stats = {"produced": self.frame_id, "skipped": self.skipped, "consumers": {}}
+        if self.frame_ring is not None:
+            stats["ring_dropped"] = self.ring_dropped
+        for i, q in enumerate(self.queues):
+            if hasattr(q, "stats"):
+                stats["consumers"][getattr(q, "name", str(i))] = q.stats()
+        return stats
 
-        print("[Producer] Stopped.")
+    def _release(self, payload):
+        if "slot" in payload:
+            self.frame_ring.release(payload["slot"])
@@ -0,0 +1,274 @@
+# result_sink.py
+# The end of the live pipeline: everything the workers produce (detections, recognition results) and, when
+# something needs pixels, the frames themselves end up here, on one thread that does all the slow output work:
+# drawing, the preview window, video encoding, log writes and console output. Workers only ever put_nowait() into
+# its queues, so a slow terminal, disk or window never holds up detection.
+
+import os
+import gzip
+import json
+import threading
+import time
+from collections import OrderedDict
+from queue import Queue, Empty, Full
+import cv2
+
+import config
+from frame_queue import LatestQueue
+from metrics import REGISTRY as metrics
+
+
+def publish(sink_queue, event):
+    """
+    Hands event to a sink without ever blocking the caller. No-op without a sink; dropped (and counted) if it's full.
+    """
+    if sink_queue is None:
+        return
+    try:
+        sink_queue.put_nowait(event)
+    except Full:
+        metrics.inc("dropped_total", where="sink")
+
+
+class ResultLog:
+    """
+    Buffered JSON lines log, one record per detection event or recognition result. A path ending in .gz is written
+    gzip-compressed. Flushed every flush_interval seconds rather than per line.
+    """
+    def __init__(self, path, flush_interval=2.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if path.endswith(".gz"):
+            self.file = gzip.open(path, "at", encoding="utf-8")
+        else:
+            self.file = open(path, "a", encoding="utf-8", buffering=1 << 20)
+        self.flush_interval = flush_interval
+        self.next_flush = time.monotonic() + flush_interval
+
+    def write(self, record):
+        self.file.write(json.dumps(record, default=_json_default) + "\n")
+
+    def maybe_flush(self):
+        if time.monotonic() >= self.next_flush:
+            self.file.flush()
+            self.next_flush = time.monotonic() + self.flush_interval
+
+    def close(self):
+        self.file.close()
+
+
+def _json_default(value):
+    # numpy scalars from the workers (LBPH labels, box coordinates)
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Can't log {type(value).__name__}")
+
+
+class ResultSink(threading.Thread):
+    """
+    events: detection events ({"frame_id", "source_id", "timestamp", "boxes"[, "track_ids", "recognitions",
+    "pending"]}) and FaceWorker results (anything with a "label") go in here. frames: a LatestQueue the producer also pushes to, only created when
+    show_feed or a video path needs the pixels.
+
+    Frames are joined back to their detections by (source_id, frame_id). Once a frame's detections are in it waits
+    up to join_timeout for the recognition results of its faces (with tracking: only of the faces marked pending,
+    the rest come with their track's cached result), then gets drawn (boxes, plus label and distance for
+    faces that were recognized) and shown and/or written to video. Frames whose detections never arrive (dropped
+    before the detector got to them) are just discarded.
+    Matches are always printed; with debug every detection and recognition is.
+    """
+    def __init__(self, stop_event, show_feed=None, debug=None, log_path=None, video_path=None, frame_ring=None):
+        super().__init__(daemon=True, name="ResultSink")
+        self.stop_event = stop_event
+        self.show_feed = config.SHOW_FEED if show_feed is None else show_feed
+        self.debug = config.DEBUG_RESULTS if debug is None else debug
+        self.log_path = log_path or config.RESULT_LOG_PATH
+        self.video_path = video_path or config.RESULT_VIDEO_PATH
+        self.frame_ring = frame_ring
+        self.events = Queue(maxsize=config.SINK_QUEUE_SIZE)
+        # Drained every pass of the loop (and copied out of the frame ring straight away), so it can stay short.
+        self.frames = LatestQueue(maxsize=2, name="sink") if self.wants_frames else None
+        self.join_timeout = config.SINK_JOIN_TIMEOUT
+
+        self.pending_frames = OrderedDict()  # (source_id, frame_id) -> frame
+        self.pending = OrderedDict()         # (source_id, frame_id) -> {"boxes", "results", "due"}
+        self.writers = {}
+        self.log = None
+        self.rendered = 0
+        self.matches = 0
+
+    @property
+    def wants_frames(self):
+        return bool(self.show_feed or self.video_path)
+
+    def run(self):
+        print("[ResultSink] Starting.")
+        if self.log_path:
+            self.log = ResultLog(self.log_path, config.RESULT_LOG_FLUSH_INTERVAL)
+        try:
+            while not self.stop_event.is_set():
+                # Events first (that's where the loop waits), then frames: a frame is always queued before its
+                # detections, so this way it's in by the time a detection event that needs no waiting renders.
+                self._take_events()
+                self._take_frames()
+                self._render_ready(time.monotonic())
+                if self.log is not None:
+                    self.log.maybe_flush()
+                if self.show_feed and cv2.waitKey(1) & 0xFF == ord("q"):
+                    print("[ResultSink] 'q' pressed, stopping.")
+                    self.stop_event.set()
+            # Draw whatever was still waiting on recognition results.
+            self._take_events()
+            self._render_ready(float("inf"))
+        finally:
+            self._close()
+        print(f"[ResultSink] Stopped. {self.rendered} frames drawn, {self.matches} matches.")
+
+    def _take_frames(self):
+        if self.frames is None:
+            return
+        while True:
+            try:
+                payload = self.frames.get_nowait()
+            except Empty:
+                return
+            if "slot" in payload:
+                frame = self.frame_ring.view(payload["slot"]).copy()
+                self.frame_ring.release(payload["slot"])
+            else:
+                frame = payload["frame"]
+            self.pending_frames[(payload.get("source_id"), payload["frame_id"])] = frame
+            while len(self.pending_frames) > config.SINK_MAX_PENDING:
+                self.pending_frames.popitem(last=False)
+
+    def _take_events(self):
+        # Block briefly for the first event so the loop doesn't spin, then take whatever else is queued.
+        timeout = 0.02
+        while True:
+            try:
+                event = self.events.get(timeout=timeout) if timeout else self.events.get_nowait()
+            except Empty:
+                return
+            timeout = 0
+            if "label" in event:
+                self._on_recognition(event)
+            else:
+                self._on_detections(event)
+
+    def _on_detections(self, event):
+        key = (event.get("source_id"), event["frame_id"])
+        if self.log is not None:
+            self.log.write(dict(event, kind="detections"))
+        if self.debug and event["boxes"]:
+            print(f"[ResultSink] {self._where(event)}: {len(event['boxes'])} faces {event['boxes']}")
+        # Tracked faces carry their track's last recognition; only the ones sent off again are worth waiting for.
+        cached = event.get("recognitions") or [None] * len(event["boxes"])
+        pending = event.get("pending") or [True] * len(event["boxes"])
+        track_ids = event.get("track_ids") or [None] * len(cached)
+        for track_id, result, wait in zip(track_ids, cached, pending):
+            # A pending face gets reported when its fresh result comes in instead.
+            if result is not None and result["match"] and not wait:
+                self.matches += 1
+                print(f"[ResultSink] {self._where(event)}: target match (track #{track_id}, distance {result['distance']:.1f})")
+        if not self.wants_frames:
+            return
+        if not event["boxes"] and key not in self.pending_frames:
+            return
+        results = {tuple(box): result for box, result in zip(event["boxes"], cached) if result is not None}
+        waiting = {tuple(box) for box, wait in zip(event["boxes"], pending) if wait}
+        self.pending[key] = {"boxes": event["boxes"], "track_ids": event.get("track_ids"), "results": results,
+                             "waiting": waiting, "due": time.monotonic() + (self.join_timeout if waiting else 0.0)}
+
+    def _on_recognition(self, result):
+        if self.log is not None:
+            self.log.write(dict(result, kind="recognition"))
+        if result["match"]:
+            self.matches += 1
+            print(f"[ResultSink] {self._where(result)}: target match (distance {result['distance']:.1f})")
+        elif self.debug:
+            print(f"[ResultSink] {self._where(result)}: label {result['label']}, distance {result['distance']:.1f}")
+        record = self.pending.get((result.get("source_id"), result["frame_id"]))
+        if record is not None and result.get("box") is not None:
+            record["results"][tuple(result["box"])] = result
+            record["waiting"].discard(tuple(result["box"]))
+            if not record["waiting"]:
+                record["due"] = 0.0
+
+    @staticmethod
+    def _where(event):
+        if event.get("source_id") is None:
+            return f"Frame {event['frame_id']}"
+        return f"Camera {event['source_id']} frame {event['frame_id']}"
+
+    def _render_ready(self, now):
+        for key in [key for key, record in self.pending.items() if record["due"] <= now]:
+            record = self.pending.pop(key)
+            frame = self.pending_frames.pop(key, None)
+            if frame is None:
+                continue
+            # Anything older from the same camera is never going to be drawn now.
+            source_id, frame_id = key
+            for old in [k for k in self.pending_frames if k[0] == source_id and k[1] < frame_id]:
+                del self.pending_frames[old]
+            self._draw(frame, record)
+            self._output(source_id, frame)
+            self.rendered += 1
+
+    def _draw(self, frame, record):
+        track_ids = record["track_ids"] or [None] * len(record["boxes"])
+        for box, track_id in zip(record["boxes"], track_ids):
+            x, y, w, h = (int(v) for v in box)
+            result = record["results"].get(tuple(box))
+            color = (0, 0, 255) if result and result["match"] else (0, 255, 0)
+            cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+            label = f"#{track_id} " if track_id is not None else ""
+            if result is not None:
+                label += f"{'TARGET' if result['match'] else result['label']} {result['distance']:.0f}"
+            if label:
+                cv2.putText(frame, label.strip(), (x, max(12, y - 6)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+
+    def _output(self, source_id, frame):
+        if self.show_feed:
+            cv2.imshow("Recaller" if source_id is None else f"Recaller - camera {source_id}", frame)
+        if self.video_path:
+            writer = self.writers.get(source_id)
+            if writer is None:
+                path = self.video_path.format(source=_safe_name(source_id))
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                height, width = frame.shape[:2]
+                writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*config.RESULT_VIDEO_FOURCC),
+                                         config.RESULT_VIDEO_FPS, (width, height))
+                if not writer.isOpened():
+                    print(f"[ResultSink] Warning: could not open video writer for {path}, not recording.")
+                    self.video_path = None
+                    return
+                self.writers[source_id] = writer
+            writer.write(frame)
+
+    def _close(self):
+        for writer in self.writers.values():
+            writer.release()
+        if self.log is not None:
+            self.log.close()
+        if self.show_feed:
+            try:
+                cv2.destroyAllWindows()
+            except cv2.error:
+                pass
+        # Give back any ring slots still sitting in the frame queue.
+        if self.frames is not None and self.frame_ring is not None:
+            while True:
+                try:
+                    payload = self.frames.get_nowait()
+                except Empty:
+                    break
+                if "slot" in payload:
+                    self.frame_ring.release(payload["slot"])
+
+
+def _safe_name(source_id):
+    # Camera indices are ints, video sources are paths; either way make something that fits in a file name.
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in str(source_id))
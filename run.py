@@ -1,53 +1,36 @@
+import time
+STARTED_AT = time.time()  # before the heavy imports, so the startup report covers them
 import sys
 import argparse
-import threading
-from queue import Queue
 # Relative imports
 import config
 from targetter import FacePackager, FaceTrainer
-from camera_stream import CameraStream
-from producer import FrameProducer
-from workers import FaceWorker, DetectWorker
-
-def run_system(cam_index=None):
-    stop_event = threading.Event()
-    camera = CameraStream(cam_index=cam_index)
-
-    detect_queue = Queue(maxsize=config.DETECT_QUEUE_SIZE)
-    face_queue = Queue(maxsize=config.FACE_QUEUE_SIZE)
-
-    producer = FrameProducer(camera, [detect_queue], stop_event)
-    detect_worker = DetectWorker(detect_queue, stop_event, face_output_queue=face_queue, name="DetectWorker")
-    face_worker = FaceWorker(face_queue, stop_event, name="FaceWorker")
-
-    threads = [producer, detect_worker, face_worker]
-    for t in threads:
-        t.start()
-
-    try:
-        print("[Coordinator] System running. Press Ctrl+C to stop.")
-        while not stop_event.is_set():
-            for t in threads:
-                if not t.is_alive():
-                    raise RuntimeError(f"{t.name} thread died unexpectedly.")
-            threading.Event().wait(1)
-    except KeyboardInterrupt:
-        print("\n[Coordinator] Shutdown signal received.")
-        stop_event.set()
-
-    print("[Coordinator] Waiting for threads to finish...")
-    for t in threads:
-        t.join()
-
-    print("[Coordinator] Releasing camera...")
-    camera.release()
-
-    print("[Coordinator] All threads stopped. Exiting cleanly.")
-
+from coordinator import run_system
+import dnn_backend
+import identity_cluster
 
 def run_targetter(args, nms_mode=True):
     pass
 
+def add_dnn_args(parser):
+    parser.add_argument("--backend", choices=sorted(dnn_backend.BACKENDS), help="cv2.dnn backend for the detection net (config.DNN_BACKEND).")
+    parser.add_argument("--target", choices=sorted(dnn_backend.TARGETS), help="cv2.dnn target for the detection net (config.DNN_TARGET).")
+    parser.add_argument("--input_size", type=int, help="Detection net input resolution, a multiple of 32 (config.DETECT_INPUT_SIZE).")
+    parser.add_argument("--threads", type=int, help="OpenCV inference threads (config.DNN_THREADS).")
+
+def apply_dnn_args(args):
+    # Saved autotune profile first, then anything given on the command line on top of it.
+    dnn_backend.load_profile()
+    dnn_backend.apply_settings({"DNN_BACKEND": args.backend, "DNN_TARGET": args.target,
+                                "DETECT_INPUT_SIZE": args.input_size, "DNN_THREADS": args.threads})
+
+def run_autotune():
+    frames = dnn_backend.sample_frames()
+    print(f"[DNN] Autotuning on {len(frames)} sample frames...")
+    settings, results = dnn_backend.autotune(frames)
+    dnn_backend.save_profile(settings, results)
+    print(f"[DNN] Best profile: {settings}, saved to {config.DNN_PROFILE_PATH}")
+
 # Will parse arguments and default to live-feed mode if targetting mode is not set.
 def parse_args_with_default_mode(default_mode="live"):
     parser = argparse.ArgumentParser(
@@ -58,12 +41,27 @@ def parse_args_with_default_mode(default_mode="live"):
   # Subparser for default live feed mode
     parser_mode1 = subparsers.add_parser("live", help="Run in live mode; default behaviour, does not need to be set even if using additional sub-args.")
     parser_mode1.add_argument("--cam", type=int, help="Camera index to use. No default, but you probably want 0 unless you have multiple cams hooked up.")
+    parser_mode1.add_argument("--cams", type=int, nargs="+", help="Run several cameras at once (e.g. --cams 0 1), sharing one set of detection and recognition workers.")
+    parser_mode1.add_argument("--track", action="store_true", help="Track faces between frames so detection and recognition don't run on every frame.")
+    parser_mode1.add_argument("--detect_processes", type=int, help="Run detection in this many separate processes instead of a single worker thread.")
+    parser_mode1.add_argument("--show_feed", action="store_true", help="Show the camera view with detection boxes and recognition labels drawn on. Press 'q' in the window to stop.")
+    parser_mode1.add_argument("--debug", action="store_true", help="Print every detection and recognition result to the console, not just target matches.")
+    parser_mode1.add_argument("--log", help="Append detections and recognition results to this JSON lines file (.gz to compress).")
+    parser_mode1.add_argument("--record", help="Write the annotated frames to this video file; {source} in the name is replaced by the camera.")
+    parser_mode1.add_argument("--package", action="store_true", help="Harvest target faces from the live feed instead of recognizing them: distinct face crops get saved to the target output dir for training.")
+    parser_mode1.add_argument("--reload_model", type=float, metavar="SECONDS", help="Check the trained target model this often and swap in a newer one (e.g. after `targetter --update`) without restarting.")
+    parser_mode1.add_argument("--autotune", action="store_true", help="Time the available DNN backend/target/input size/thread combinations on sample frames, save the best as the profile for later runs, and exit.")
+    add_dnn_args(parser_mode1)
 
   # Subparser for targetting mode
     parser_mode2 = subparsers.add_parser("targetter", help="Run the still image target packager.")
     parser_mode2.add_argument("--build_test_images", action="store_true", help="Export to off-target face dataset instead of target set.")
     parser_mode2.add_argument("--no_nms", action="store_true", help="Disable NMS during face packaging.")
     parser_mode2.add_argument("--test_recognition", action="store_true", help="Run a recognition test and print the scores to the console.")
+    parser_mode2.add_argument("--eval", action="store_true", help="With --test_recognition: score held-out target and off-target sets, compute ROC/EER and write a JSON report.")
+    parser_mode2.add_argument("--update", action="store_true", help="Package, then add only the crops the saved target model doesn't have yet instead of retraining it from scratch (also applies to --test_recognition and --cluster training).")
+    parser_mode2.add_argument("--cluster", action="store_true", help="Target photos have several people in them: keep only the face common to them and train on that (after packaging, or with --test_recognition).")
+    add_dnn_args(parser_mode2)
 
     # If help is explicitly requested, show global help
     if "--help" in sys.argv or "-h" in sys.argv:
@@ -85,6 +83,10 @@ def main():
     # alright so at this moment we are trying to split up our entries
     # we should be handling all argument stuff here, and pass the
     # decoded arguments as parameters for our class.
+    if args.mode == "live" and args.autotune:
+        run_autotune()
+        return
+    apply_dnn_args(args)
 
     if args.mode == "targetter":
         # Set the defaults
@@ -94,9 +96,14 @@ def main():
 
         # Override based on arguments
         if args.test_recognition:
-            test_recognizer = FaceTrainer(output_dir, config.OFFTARGET_OUTPUT_DIR, config.TARGET_FACE_PATH)
-            test_recognizer.train()
-            test_recognizer.test()
+            train_names = identity_cluster.cluster_folder(output_dir) if args.cluster else None
+            test_recognizer = FaceTrainer(output_dir, config.OFFTARGET_OUTPUT_DIR, config.TARGET_FACE_PATH,
+                                          train_names=train_names)
+            if args.eval:
+                test_recognizer.evaluate()
+            else:
+                test_recognizer.train(incremental=args.update)
+                test_recognizer.test()
 
         else:
             if args.build_test_images: # Populate the offtarget directory instead of normal one.
@@ -107,12 +114,18 @@ def main():
 
             target_packager = FacePackager(input_dir, output_dir, nms_mode=nms_mode)
             target_packager.run()
+            if (args.cluster or args.update) and not args.build_test_images:
+                train_names = identity_cluster.cluster_folder(output_dir) if args.cluster else None
+                trainer = FaceTrainer(output_dir, config.OFFTARGET_OUTPUT_DIR, config.TARGET_FACE_PATH,
+                                      train_names=train_names)
+                trainer.train(incremental=args.update)
 
     else:
-        if args.cam != None:
-            run_system(cam_index = args.cam)
-        else:
-            run_system()
+        detect_engine = "process" if args.detect_processes else None
+        run_system(cam_index=args.cam, detect_engine=detect_engine, detect_processes=args.detect_processes,
+                   tracking=args.track or None, cam_indices=args.cams, started_at=STARTED_AT,
+                   show_feed=args.show_feed or None, debug=args.debug or None, log_path=args.log, video_path=args.record,
+                   package=args.package, reload_interval=args.reload_model)
 
 if __name__ == "__main__":
     main()
@@ -1,8 +1,16 @@
 import os
+import re
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 import argparse
 import config
+import yolo_decode
+from model_registry import MODELS
+from face_cache import FaceCache
+import evaluation
 
 ### TARGETTER MODE CLASSES
 class FacePackager:
@@ -10,8 +18,18 @@ class FacePackager:
     This class is used with targetting mode to extract faces from still images and store them for training or testing.
     It accepts an argument to turn off NMS which will allow overlapping detections (as in, it will pull multiple crops, usually max of two,
     from a single image/face.)
+
+    Packaging is incremental: a manifest in the output dir maps each source image's content hash to the crops it
+    produced, along with a hash of the model and settings. Images whose content (and model/settings) haven't changed
+    since the last run are skipped, and crops are named after the source hash so they keep their names between runs.
+    Reading/decoding/preprocessing runs on a thread pool and the forward passes are batched.
     """
-    def __init__(self, input_dir, output_dir, confidence_threshold=0.5, face_class_id=1, nms_mode=True):
+    MANIFEST_NAME = ".manifest.json"
+    STALE_DIR = "stale"
+    # Crops this class writes: face_<hash12>_NN.jpg now, face_NNNN.jpg from before there was a manifest.
+    CROP_PATTERN = re.compile(r"face_(\d{4,}|[0-9a-f]{12}_\d{2})\.jpg$")
+
+    def __init__(self, input_dir, output_dir, confidence_threshold=0.5, face_class_id=1, nms_mode=True, workers=None, batch_size=None):
 
         self.input_dir = input_dir
         self.output_dir = output_dir
@@ -19,82 +37,153 @@ class FacePackager:
         self.face_class_id = face_class_id
         self.image_extensions = {".jpg", ".jpeg", ".png", ".bmp"}
         self.nms_mode = nms_mode
+        self.workers = workers or config.PACKAGER_WORKERS or os.cpu_count()
+        self.batch_size = batch_size or config.PACKAGER_BATCH_SIZE
+        self.manifest_path = os.path.join(self.output_dir, self.MANIFEST_NAME)
         os.makedirs(self.output_dir, exist_ok=True)
         self._load_model()
 
     def _load_model(self):
-        self.net = cv2.dnn.readNetFromDarknet(config.DETECT_CFG_PATH, config.DETECT_WEIGHTS_PATH)
-        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
-        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
-        layer_names = self.net.getLayerNames()
-        self.output_layers = [layer_names[i - 1] for i in self.net.getUnconnectedOutLayers()]
+        model = MODELS.darknet(config.DETECT_CFG_PATH, config.DETECT_WEIGHTS_PATH)
+        self.net = model.net
+        self.output_layers = model.output_layers
 
-    def run(self):
-        count = 0
+    def model_hash(self):
+        # Anything that changes which crops come out of an image has to go in here.
+        digest = hashlib.sha1()
+        for path in (config.DETECT_CFG_PATH, config.DETECT_WEIGHTS_PATH):
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        digest.update(f"{self.confidence_threshold}|{self.face_class_id}|{self.nms_mode}|{config.DETECT_INPUT_SIZE}|150".encode())
+        return digest.hexdigest()
 
-        for filename in os.listdir(self.input_dir):
-            if not any(filename.lower().endswith(ext) for ext in self.image_extensions):
-                continue
+    def _load_manifest(self, model_hash):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+        if not manifest or manifest.get("model") != model_hash:
+            return {"model": model_hash, "images": {}}
+        return manifest
 
-            path = os.path.join(self.input_dir, filename)
-            image = cv2.imread(path)
-            if image is None:
-                print(f"[WARN] Failed to read {filename}")
+    def _save_manifest(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _retire_stale_crops(self, manifest):
+        """
+        Moves packager crops the manifest doesn't account for (face_NNNN.jpg ones from before manifests, ones cut
+        with another model/settings, or ones whose source picture has since been deleted or edited) into a stale/
+        subfolder. Otherwise re-packaging the same pictures cuts them
+        again under new names, doubling the training set and putting near-identical faces on both sides of
+        FaceTrainer.evaluate()'s train/held-out split. Crops from elsewhere (live_*.jpg from live --package) stay.
+        """
+        known = {crop for entry in manifest["images"].values() for crop in entry["crops"]}
+        stale = [f for f in sorted(os.listdir(self.output_dir)) if self.CROP_PATTERN.match(f) and f not in known]
+        if not stale:
+            return
+        stale_dir = os.path.join(self.output_dir, self.STALE_DIR)
+        os.makedirs(stale_dir, exist_ok=True)
+        for filename in stale:
+            os.replace(os.path.join(self.output_dir, filename), os.path.join(stale_dir, filename))
+        print(f"[WARN] Moved {len(stale)} crops the manifest no longer accounts for (older run, other model/settings, "
+              f"or a deleted/edited picture) to {stale_dir} so they don't get trained on.")
+
+    def _prepare(self, filename, known_hashes):
+        # Runs on the pool. Reads the file once, hashes it, and only decodes/preprocesses it if it's new.
+        path = os.path.join(self.input_dir, filename)
+        with open(path, "rb") as f:
+            data = f.read()
+        content_hash = hashlib.sha1(data).hexdigest()
+        if content_hash in known_hashes:
+            return filename, content_hash, None, None
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return filename, content_hash, None, None
+        blob = cv2.dnn.blobFromImage(image, 1 / 255.0, (config.DETECT_INPUT_SIZE, config.DETECT_INPUT_SIZE), swapRB=True, crop=False)
+        return filename, content_hash, image, blob
+
+    def _extract_faces(self, image, outputs):
+        height, width = image.shape[:2]
+        nms_threshold = 0.3 if self.nms_mode else None
+        boxes, _, _ = yolo_decode.decode(outputs, width, height, self.confidence_threshold,
+                                         class_id=self.face_class_id, nms_threshold=nms_threshold)
+        faces = []
+        for x, y, w, h in boxes:
+            face_crop = image[y:y + h, x:x + w]
+            if face_crop.size == 0:
                 continue
+            faces.append(cv2.resize(face_crop, (150, 150)))
+        return faces
 
-            height, width = image.shape[:2]
-            blob = cv2.dnn.blobFromImage(image, 1 / 255.0, (416, 416), swapRB=True, crop=False)
-            self.net.setInput(blob)
-            outputs = self.net.forward(self.output_layers)
-
-            boxes = []
-            confidences = []
-
-            for output in outputs:
-                for detection in output:
-                    scores = detection[5:]
-                    class_id = int(np.argmax(scores))
-                    confidence = scores[class_id]
-
-                    if confidence < self.confidence_threshold or class_id != self.face_class_id:
-                        continue
-
-                    center_x = int(detection[0] * width)
-                    center_y = int(detection[1] * height)
-                    w = int(detection[2] * width)
-                    h = int(detection[3] * height)
-                    x = max(0, int(center_x - w / 2))
-                    y = max(0, int(center_y - h / 2))
-                    w = min(w, width - x)
-                    h = min(h, height - y)
-
-                    boxes.append([x, y, w, h])
-                    confidences.append(float(confidence))
-
-            if not self.nms_mode:
-                for box in boxes:
-                    x, y, w, h = box
-                    face_crop = image[y:y + h, x:x + w]
-                    if face_crop.size == 0:
-                        continue
-                    face_resized = cv2.resize(face_crop, (150, 150))
-                    out_name = f"face_{count:04d}.jpg"
-                    cv2.imwrite(os.path.join(self.output_dir, out_name), face_resized)
-                    count += 1
-            else:
-                indices = cv2.dnn.NMSBoxes(boxes, confidences, self.confidence_threshold, 0.3)
-                for i in indices:
-                    i = i[0] if isinstance(i, (list, tuple, np.ndarray)) else i
-                    x, y, w, h = boxes[i]
-                    face_crop = image[y:y + h, x:x + w]
-                    if face_crop.size == 0:
-                        continue
-                    face_resized = cv2.resize(face_crop, (150, 150))
-                    out_name = f"face_{count:04d}.jpg"
-                    cv2.imwrite(os.path.join(self.output_dir, out_name), face_resized)
-                    count += 1
-
-            print(f"[DONE] Saved {count} face images to {self.output_dir}")
+    def run(self):
+        manifest = self._load_manifest(self.model_hash())
+        self._retire_stale_crops(manifest)
+        images = manifest["images"]
+        filenames = sorted(f for f in os.listdir(self.input_dir)
+                           if any(f.lower().endswith(ext) for ext in self.image_extensions))
+        batches = [filenames[i:i + self.batch_size] for i in range(0, len(filenames), self.batch_size)]
+        known_hashes = set(images)
+
+        new_images = 0
+        skipped = 0
+        saved = 0
+        writes = []
+        seen = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # Keep one batch of reads in flight while the current batch goes through the net.
+            pending = [pool.submit(self._prepare, f, known_hashes) for f in batches[0]] if batches else []
+            for i in range(len(batches)):
+                current = [future.result() for future in pending]
+                pending = [pool.submit(self._prepare, f, known_hashes) for f in batches[i + 1]] if i + 1 < len(batches) else []
+
+                todo = []
+                for filename, content_hash, image, blob in current:
+                    seen[content_hash] = filename
+                    if content_hash in images:
+                        skipped += 1
+                    elif image is None:
+                        print(f"[WARN] Failed to read {filename}")
+                    elif any(content_hash == h for _, h, _, _ in todo):
+                        skipped += 1  # same picture twice in this batch under different names
+                    else:
+                        todo.append((filename, content_hash, image, blob))
+                if not todo:
+                    continue
+
+                self.net.setInput(np.concatenate([blob for _, _, _, blob in todo]))
+                outputs = self.net.forward(self.output_layers)
+                for j, (filename, content_hash, image, _) in enumerate(todo):
+                    frame_outputs = outputs if len(todo) == 1 else [output[j] for output in outputs]
+                    crops = []
+                    for k, face in enumerate(self._extract_faces(image, frame_outputs)):
+                        out_name = f"face_{content_hash[:12]}_{k:02d}.jpg"
+                        writes.append(pool.submit(cv2.imwrite, os.path.join(self.output_dir, out_name), face))
+                        crops.append(out_name)
+                    images[content_hash] = {"source": filename, "crops": crops}
+                    known_hashes.add(content_hash)
+                    new_images += 1
+                    saved += len(crops)
+
+            for future in writes:
+                future.result()
+
+        # Entries for pictures that were deleted or edited since (so hash differently now) go, and their crops with
+        # them, or they'd stay in the training set for good. Renamed pictures just get their source updated.
+        removed = [content_hash for content_hash in images if content_hash not in seen]
+        for content_hash in removed:
+            del images[content_hash]
+        for content_hash, entry in images.items():
+            entry["source"] = seen[content_hash]
+        self._save_manifest(manifest)
+        if removed:
+            self._retire_stale_crops(manifest)
+        print(f"[DONE] {new_images} new images, {skipped} unchanged skipped, {len(removed)} removed or changed. "
+              f"Saved {saved} face images to {self.output_dir}")
 
 
 class FaceTrainer:
@@ -104,43 +193,188 @@ class FaceTrainer:
     train_dir == target, the directory holding the processed bounded faces of the target
     test_dir  == offtarget, the directory holding the processed bounded faces to test against
     face_model_output_path == target as well.
+    use_cache == load faces through a FaceCache (preprocessed, memory-mapped .npy kept in each folder) instead of
+                 decoding every file on every run.
+    train_names == only these crops of train_dir count as the target (e.g. the common identity picked by
+                   identity_cluster.cluster_folder when the target photos have other people in them). None = all.
+
+    Every save also writes a sidecar manifest next to the model (trained_target.manifest.json) listing the crops it
+    was trained on by name, size and mtime, which is what lets train(incremental=True) feed LBPH only the new ones.
     """
-    def __init__(self, train_dir, test_dir, face_model_output_path, face_size=(150, 150), label_id=1):
+    def __init__(self, train_dir, test_dir, face_model_output_path, face_size=(150, 150), label_id=1, use_cache=True,
+                 train_names=None):
         self.train_dir = train_dir
         self.test_dir = test_dir
         self.face_model_output_path = face_model_output_path #+ "/target_face.xml"
         self.face_size = face_size
         self.label_id = label_id
+        self.use_cache = use_cache
+        self.train_names = None if train_names is None else set(train_names)
         self.recognizer = cv2.face.LBPHFaceRecognizer_create()
 
-    def load_images_from_folder(self, folder, label_id):
-        images = []
-        labels = []
-        for filename in os.listdir(folder):
+    def load_faces(self, folder):
+        """
+        Returns (faces, names) for every readable image in folder, faces as an (N, height, width) grayscale array.
+        """
+        if self.use_cache:
+            return FaceCache(folder, self.face_size).load()
+        faces = []
+        names = []
+        for filename in sorted(os.listdir(folder)):
             path = os.path.join(folder, filename)
             img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
             if img is None:
                 continue
-            img_resized = cv2.resize(img, self.face_size)
-            images.append(img_resized)
-            labels.append(label_id)
-        return images, labels
+            faces.append(cv2.resize(img, self.face_size))
+            names.append(filename)
+        if not faces:
+            return np.empty((0, self.face_size[1], self.face_size[0]), np.uint8), names
+        return np.stack(faces), names
 
-    def train(self):
+    def load_target_faces(self):
+        faces, names = self.load_faces(self.train_dir)
+        if self.train_names is None:
+            return faces, names
+        keep = [i for i, name in enumerate(names) if name in self.train_names]
+        return faces[keep], [names[i] for i in keep]
+
+    def load_images_from_folder(self, folder, label_id):
+        faces, _ = self.load_target_faces() if folder == self.train_dir else self.load_faces(folder)
+        # Rows of the (memory-mapped) array are already contiguous images, no copy needed.
+        return list(faces), [label_id] * len(faces)
+
+    @property
+    def manifest_path(self):
+        return os.path.splitext(self.face_model_output_path)[0] + ".manifest.json"
+
+    def _crop_stamps(self, names):
+        stamps = {}
+        for name in names:
+            st = os.stat(os.path.join(self.train_dir, name))
+            stamps[name] = [st.st_size, st.st_mtime_ns]
+        return stamps
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            model_mtime = os.stat(self.face_model_output_path).st_mtime_ns
+        except (OSError, ValueError):
+            return None
+        # A model saved by anything else (or an older version of this) since the manifest was written isn't the one
+        # the manifest describes.
+        if manifest.get("model_mtime") != model_mtime:
+            return None
+        return manifest
+
+    def _save(self, stamps):
+        # Model and manifest both go in under a temporary name and get renamed into place, so a FaceWorker watching
+        # the model file never reads half of one.
+        root, ext = os.path.splitext(self.face_model_output_path)
+        tmp_model = root + ".tmp" + ext
+        self.recognizer.save(tmp_model)
+        os.replace(tmp_model, self.face_model_output_path)
+        manifest = {
+            "train_dir": self.train_dir,
+            "face_size": list(self.face_size),
+            "label_id": self.label_id,
+            "model_mtime": os.stat(self.face_model_output_path).st_mtime_ns,
+            "crops": stamps,
+        }
+        tmp_manifest = self.manifest_path + ".tmp"
+        with open(tmp_manifest, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_manifest, self.manifest_path)
+
+    def _update_plan(self, stamps):
+        """
+        Returns (names to add, None) if the saved model can be brought up to date with LBPH's update(), or
+        (None, reason) if it needs a full retrain: update() can only add faces, not take any back out.
+        """
+        manifest = self._read_manifest()
+        if manifest is None:
+            return None, "no manifest for the saved model"
+        if (manifest.get("train_dir") != self.train_dir or manifest.get("face_size") != list(self.face_size)
+                or manifest.get("label_id") != self.label_id):
+            return None, "training settings changed"
+        trained = manifest["crops"]
+        removed = [name for name, stamp in trained.items() if stamps.get(name) != stamp]
+        if removed:
+            return None, f"{len(removed)} trained crops removed from the training set or changed"
+        return [name for name in stamps if name not in trained], None
+
+    def train(self, incremental=False):
+        """
+        Trains the target model and saves it. With incremental, a saved model whose manifest shows it was trained on
+        a subset of the current crops is loaded and only the new crops are added to it; anything else (no model yet,
+        crops removed or changed, different settings) falls back to training from scratch.
+        """
         print("[INFO] Loading training data...")
-        train_images, train_labels = self.load_images_from_folder(self.train_dir, self.label_id)
-        self.recognizer.train(train_images, np.array(train_labels))
-        self.recognizer.save(self.face_model_output_path)
+        faces, names = self.load_target_faces()
+        stamps = self._crop_stamps(names)
+        if incremental:
+            new_names, reason = self._update_plan(stamps)
+            if new_names is not None:
+                # Either way the saved model is the one to use, e.g. for test() straight after.
+                self.recognizer.read(self.face_model_output_path)
+                if not new_names:
+                    print(f"[INFO] Model at {self.face_model_output_path} already has all {len(names)} crops, nothing to do.")
+                    return
+                new = set(new_names)
+                rows = [i for i, name in enumerate(names) if name in new]
+                self.recognizer.update([faces[i] for i in rows], np.full(len(rows), self.label_id))
+                self._save(stamps)
+                print(f"[INFO] Model updated with {len(rows)} new crops ({len(names)} total) and saved to {self.face_model_output_path}")
+                return
+            print(f"[INFO] Retraining from scratch: {reason}.")
+        # Rows of the (memory-mapped) array are already contiguous images, no copy needed.
+        self.recognizer.train(list(faces), np.full(len(faces), self.label_id))
+        self._save(stamps)
         print(f"[INFO] Model trained and saved to {self.face_model_output_path}")
 
     def test(self):
         print("[INFO] Testing recognition on test images...")
-        for filename in os.listdir(self.test_dir):
-            path = os.path.join(self.test_dir, filename)
-            test_img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
-            if test_img is None:
-                print(f"[WARN] Could not read {filename}")
-                continue
-            test_img_resized = cv2.resize(test_img, self.face_size)
-            label, confidence = self.recognizer.predict(test_img_resized)
+        test_faces, names = self.load_faces(self.test_dir)
+        for filename, test_img in zip(names, test_faces):
+            label, confidence = self.recognizer.predict(test_img)
             print(f"[TEST] {filename}: predicted label={label}, confidence={confidence:.2f}")
+
+    def evaluate(self, report_path=None, holdout_fraction=None, target_far=None, workers=None):
+        """
+        Batch evaluation: holds out part of the target set, trains a throwaway model on the rest (the saved model is
+        left alone), scores the held-out target faces (genuine) and the whole test set (impostors) in parallel, and
+        writes ROC / FAR / FRR / EER plus a suggested distance threshold to a JSON report.
+        """
+        report_path = report_path or config.EVAL_REPORT_PATH
+        holdout_fraction = config.EVAL_HOLDOUT_FRACTION if holdout_fraction is None else holdout_fraction
+        target_far = config.EVAL_TARGET_FAR if target_far is None else target_far
+        workers = workers or os.cpu_count()
+
+        target_faces, target_names = self.load_target_faces()
+        test_faces, test_names = self.load_faces(self.test_dir)
+        if len(target_faces) < 2 or len(test_faces) == 0:
+            raise RuntimeError("Need at least two target faces and one off-target face to evaluate.")
+
+        # Fixed seed so repeated runs compare like with like.
+        order = np.random.default_rng(0).permutation(len(target_faces))
+        n_holdout = min(len(order) - 1, max(1, int(round(len(order) * holdout_fraction))))
+        holdout, train = np.sort(order[:n_holdout]), np.sort(order[n_holdout:])
+
+        print(f"[INFO] Evaluating: training on {len(train)} target faces, scoring {len(holdout)} held-out and {len(test_faces)} off-target.")
+        recognizer = cv2.face.LBPHFaceRecognizer_create()
+        recognizer.train([target_faces[i] for i in train], np.full(len(train), self.label_id))
+        genuine = evaluation.score_faces(recognizer, [target_faces[i] for i in holdout], workers)
+        impostor = evaluation.score_faces(recognizer, test_faces, workers)
+
+        report = evaluation.summarize(genuine, impostor, target_far)
+        report["current_threshold"] = config.RECOG_DISTANCE_THRESHOLD
+        report["genuine"] = dict(zip((target_names[i] for i in holdout), genuine.tolist()))
+        report["impostor"] = dict(zip(test_names, impostor.tolist()))
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=1)
+
+        print(f"[EVAL] EER {100 * report['eer']:.1f}% at distance {report['eer_threshold']}, AUC {report['auc']:.3f}")
+        print(f"[EVAL] Suggested threshold for FAR <= {100 * target_far:.1f}%: {report['suggested_threshold']} "
+              f"(FRR {100 * report['frr_at_suggested']:.1f}%), currently {config.RECOG_DISTANCE_THRESHOLD}")
+        print(f"[EVAL] Report written to {report_path}")
+        return report
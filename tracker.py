@@ -0,0 +1,251 @@
+# tracker.py
+# Track-and-skip stage that sits between DetectWorker and FaceWorker. Faces get a track ID that follows them across
+# frames, the net only runs on keyframes (every Nth frame, or as soon as a track is lost), and recognition results
+# are cached per track until they've decayed enough to be worth checking again.
+
+import threading
+import time
+from queue import Full
+import cv2
+import numpy as np
+
+import config
+from workers import WorkerBase
+from metrics import REGISTRY as metrics
+from result_sink import publish
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+def centroid_distance(a, b):
+    return np.hypot((a[0] + a[2] / 2) - (b[0] + b[2] / 2), (a[1] + a[3] / 2) - (b[1] + b[3] / 2))
+
+
+def create_cv_tracker(tracker_type):
+    # Trackers moved around between OpenCV versions (and KCF/CSRT need the contrib build).
+    for module in (cv2, getattr(cv2, "legacy", None)):
+        factory = getattr(module, f"Tracker{tracker_type}_create", None) if module is not None else None
+        if factory is not None:
+            return factory()
+    raise RuntimeError(f"OpenCV tracker {tracker_type} is not available in this build.")
+
+
+class Track:
+    def __init__(self, track_id, box, frame_id):
+        self.track_id = track_id
+        self.box = tuple(int(v) for v in box)
+        self.last_detected = frame_id
+        self.misses = 0
+        self.cv_tracker = None
+        # Cached recognition: the result plus a score that decays every frame, re-recognize when it's too low.
+        self.label = None
+        self.distance = None
+        self.match = False
+        self.recog_score = 0.0
+        self.pending_since = None
+
+
+class TrackStore:
+    """
+    Shared, lock-protected track state. DetectWorker asks it whether a frame needs detection, TrackWorker updates
+    the tracks, and FaceWorker records recognition results against a track_id.
+    """
+    def __init__(self, keyframe_interval=None):
+        self.keyframe_interval = keyframe_interval or config.KEYFRAME_INTERVAL
+        self.lock = threading.Lock()
+        self.tracks = {}
+        self.next_track_id = 0
+        self.last_keyframe = None
+        self.track_lost = False
+
+    def needs_detection(self, frame_id):
+        with self.lock:
+            due = (not self.tracks or self.track_lost or self.last_keyframe is None
+                   or frame_id - self.last_keyframe >= self.keyframe_interval)
+            if due:
+                self.last_keyframe = frame_id
+                self.track_lost = False
+            return due
+
+    def record_recognition(self, track_id, label, distance, match):
+        with self.lock:
+            track = self.tracks.get(track_id)
+            if track is None:
+                return
+            track.label = label
+            track.distance = distance
+            track.match = match
+            track.recog_score = 1.0
+            track.pending_since = None
+
+
+class TrackWorker(WorkerBase):
+    """
+    Takes DetectWorker's per-frame output ({"frame"/"slot", "frame_id", "timestamp", "boxes"}, boxes None on frames
+    that skipped detection), keeps the tracks up to date and only sends crops on to the face queue for tracks with
+    no (or a stale) recognition result. Face payloads carry the track_id so FaceWorker can report back.
+    In tracking mode this is what publishes boxes to the sink_queue (every frame, with track ids), not DetectWorker.
+    Each box goes out with its track's cached recognition ({"label", "distance", "match"} or None) and whether a
+    crop from this frame was just sent for recognition, so the sink only waits on FaceWorker for those.
+    """
+    def __init__(self, input_queue, stop_event, face_output_queue, track_store, name="TrackWorker", frame_ring=None,
+                 sink_queue=None):
+        self.face_output_queue = face_output_queue
+        self.sink_queue = sink_queue
+        self.store = track_store
+        self.frame_ring = frame_ring
+        self.frames = 0
+        self.keyframes = 0
+        self.track_frames = 0
+        self.recognitions = 0
+        super().__init__(input_queue, stop_event, name)
+
+    def load_model(self):
+        self.tracker_type = config.TRACKER_TYPE
+        if self.tracker_type:
+            create_cv_tracker(self.tracker_type)  # fail at startup rather than on the first keyframe
+
+    def run(self):
+        super().run()
+        if self.frames:
+            print(f"[{self.name}] {self.frames} frames, {self.keyframes} detected ({100 * self.keyframes / self.frames:.0f}%), "
+                  f"{self.recognitions} recognitions for {self.track_frames} track-frames")
+
+    def process_frame(self, payload):
+        try:
+            frame = self.frame_ring.view(payload["slot"]) if "slot" in payload else payload["frame"]
+            with self.store.lock:
+                if payload["boxes"] is not None:
+                    self.keyframes += 1
+                    self._associate(frame, payload["frame_id"], payload["boxes"])
+                else:
+                    self._follow(frame)
+                crops = self._select_for_recognition(frame, payload["frame_id"])
+                tracks = [(track.track_id, track.box, self._cached_recognition(track))
+                          for track in self.store.tracks.values()]
+            self.frames += 1
+        finally:
+            if "slot" in payload:
+                self.frame_ring.release(payload["slot"])
+
+        # Published before the crops are queued, so the sink has the frame before FaceWorker can answer for it. A
+        # crop that then doesn't fit in the face queue just leaves the sink waiting out its join timeout.
+        pending = {track_id for track_id, _ in crops}
+        publish(self.sink_queue, {
+            "frame_id": payload["frame_id"],
+            "source_id": payload.get("source_id"),
+            "timestamp": payload["timestamp"],
+            "boxes": [box for _, box, _ in tracks],
+            "track_ids": [track_id for track_id, _, _ in tracks],
+            "recognitions": [cached for _, _, cached in tracks],
+            "pending": [track_id in pending for track_id, _, _ in tracks],
+        })
+        boxes = {track_id: box for track_id, box, _ in tracks}
+        for track_id, face in crops:
+            try:
+                self.face_output_queue.put_nowait({
+                    "frame_id": payload["frame_id"],
+                    "source_id": payload.get("source_id"),
+                    "timestamp": payload["timestamp"],
+                    "track_id": track_id,
+                    "box": boxes[track_id],
+                    "face": face,
+                    "enqueued_at": time.time(),
+                })
+                self.recognitions += 1
+            except Full:
+                metrics.inc("dropped_total", where="face_queue")
+                # Clear the pending flag so the next frame tries again.
+                with self.store.lock:
+                    track = self.store.tracks.get(track_id)
+                    if track is not None:
+                        track.pending_since = None
+
+    @staticmethod
+    def _cached_recognition(track):
+        if track.label is None:
+            return None
+        return {"label": track.label, "distance": track.distance, "match": track.match}
+
+    def _associate(self, frame, frame_id, boxes):
+        tracks = self.store.tracks
+        # Greedy IoU matching, best pairs first, then centroid distance for whatever moved too far to overlap.
+        pairs = sorted(((iou(t.box, box), tid, i) for tid, t in tracks.items() for i, box in enumerate(boxes)), reverse=True)
+        matched_tracks, matched_boxes = set(), set()
+        for score, tid, i in pairs:
+            if score < config.TRACK_IOU_THRESHOLD:
+                break
+            if tid not in matched_tracks and i not in matched_boxes:
+                matched_tracks.add(tid)
+                matched_boxes.add(i)
+                self._refresh(tracks[tid], boxes[i], frame, frame_id)
+        for tid, track in tracks.items():
+            if tid in matched_tracks:
+                continue
+            candidates = [(centroid_distance(track.box, boxes[i]), i) for i in range(len(boxes)) if i not in matched_boxes]
+            if candidates:
+                dist, i = min(candidates)
+                if dist < 0.5 * max(track.box[2], track.box[3]):
+                    matched_tracks.add(tid)
+                    matched_boxes.add(i)
+                    self._refresh(track, boxes[i], frame, frame_id)
+
+        for tid in list(tracks):
+            if tid not in matched_tracks:
+                # Missed on a keyframe: detect again on the next frame rather than waiting out the interval.
+                self.store.track_lost = True
+                tracks[tid].misses += 1
+                if tracks[tid].misses > config.TRACK_MAX_MISSES:
+                    del tracks[tid]
+        for i, box in enumerate(boxes):
+            if i not in matched_boxes:
+                track = Track(self.store.next_track_id, box, frame_id)
+                self.store.next_track_id += 1
+                tracks[track.track_id] = track
+                self._refresh(track, box, frame, frame_id)
+
+    def _refresh(self, track, box, frame, frame_id):
+        track.box = tuple(int(v) for v in box)
+        track.last_detected = frame_id
+        track.misses = 0
+        if self.tracker_type:
+            track.cv_tracker = create_cv_tracker(self.tracker_type)
+            track.cv_tracker.init(frame, track.box)
+
+    def _follow(self, frame):
+        for track in self.store.tracks.values():
+            if track.cv_tracker is None:
+                continue  # no tracker: assume the face hasn't moved much since the keyframe
+            ok, box = track.cv_tracker.update(frame)
+            if ok:
+                track.box = tuple(int(v) for v in box)
+            else:
+                track.cv_tracker = None
+                self.store.track_lost = True
+
+    def _select_for_recognition(self, frame, frame_id):
+        height, width = frame.shape[:2]
+        crops = []
+        for track in self.store.tracks.values():
+            self.track_frames += 1
+            track.recog_score *= config.TRACK_RECOG_DECAY
+            if track.recog_score >= config.TRACK_RECOG_MIN:
+                continue
+            if track.pending_since is not None and frame_id - track.pending_since < self.store.keyframe_interval:
+                continue  # already asked, FaceWorker hasn't answered yet
+            x, y, w, h = track.box
+            x, y = max(0, x), max(0, y)
+            face_crop = frame[y:min(height, y + h), x:min(width, x + w)]
+            if face_crop.size == 0:
+                continue
+            track.pending_since = frame_id
+            crops.append((track.track_id, cv2.resize(face_crop, (150, 150))))
+        return crops
@@ -1,96 +1,454 @@
+import os
 import threading
-from queue import Queue, Empty
+import time
+from queue import Queue, Empty, Full
 import cv2
 import numpy as np
 
 import config
+import yolo_decode
+import cascade
+from metrics import REGISTRY as metrics
+from model_registry import MODELS
+from result_sink import publish
 #from worker_base import WorkerBase
 
 
 
 class WorkerBase(threading.Thread):
-    def __init__(self, input_queue: Queue, stop_event: threading.Event, name="Worker"):
+    def __init__(self, input_queue: Queue, stop_event: threading.Event, name="Worker", batch_size=1, batch_timeout=0.0):
         super().__init__(daemon=True, name=name)
         self.queue = input_queue
         self.stop_event = stop_event
         self.name = name
+        self.batch_size = max(1, batch_size)
+        self.batch_timeout = batch_timeout
+        self.first_result_at = None  # wall time the first batch made it through, for the startup report
         self.load_model()
 
     def run(self):
         print(f"[{self.name}] Starting.")
         while not self.stop_event.is_set():
             try:
-                payload = self.queue.get(timeout=0.1)
-                self.process_frame(payload)
+                payloads = self.get_batch()
+                # Time this worker's payloads sat in its input queue. Whoever queues a payload stamps enqueued_at;
+                # the producer's own payloads are queued the moment they're stamped, so timestamp does for those.
+                now = time.time()
+                for payload in payloads:
+                    metrics.observe("queue_wait_seconds", now - payload.get("enqueued_at", payload["timestamp"]),
+                                    worker=self.name)
+                metrics.inc("payloads_total", len(payloads), worker=self.name)
+                self.process_batch(payloads)
+                if self.first_result_at is None:
+                    self.first_result_at = time.time()
             except Empty:
                 continue
             except Exception as e:
-                print(f"[{self.name}] Error: {e}")
+                metrics.inc("errors_total", worker=self.name, error=type(e).__name__)
+                print(f"[{self.name}] Error: {type(e).__name__}: {e}")
 
         print(f"[{self.name}] Stopped.")
 
+    def get_batch(self):
+        """
+        Blocks (briefly) for the first payload, then keeps draining the queue until either batch_size payloads
+        have been collected or batch_timeout seconds have passed since the first one arrived.
+        Raises Empty if nothing showed up at all, same as a plain queue.get().
+        """
+        batch = [self.queue.get(timeout=0.1)]
+        deadline = time.monotonic() + self.batch_timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def process_batch(self, payloads):
+        for payload in payloads:
+            self.process_frame(payload)
+
     def process_frame(self, payload):
         raise NotImplementedError("Subclasses must implement process_frame().")
 
 
 class DetectWorker(WorkerBase):
-    def __init__(self, input_queue, stop_event, face_output_queue, name="DetectWorker"):
+    """
+    Runs the Darknet body/face net over incoming frames, batch_size frames per forward pass, and pushes the face
+    crops on to the face queue (or, with a track_store, the frames and their boxes on to a TrackWorker).
+    """
+    def __init__(self, input_queue, stop_event, face_output_queue, name="DetectWorker", batch_size=None, batch_timeout=None,
+                 frame_ring=None, track_store=None, cascade=None, sink_queue=None):
         self.face_output_queue = face_output_queue
-        super().__init__(input_queue, stop_event, name)
+        self.sink_queue = sink_queue
+        self.cascade = config.DETECT_CASCADE if cascade is None else cascade
+        # frames, ROIs, net input pixels, forward seconds
+        self.cascade_stats = [0, 0, 0, 0.0]
+        self.full_pass_time = None
+        self.frame_ring = frame_ring
+        self.track_store = track_store
+        # batch size -> [batches, frames, busy seconds, summed frame latency]
+        self.batch_stats = {}
+        # Smoothed busy seconds per frame, read by the producer's adaptive sampling.
+        self.service_time = 0.0
+        self.faces_emitted = 0
+        self.faces_dropped = 0
+        self.handed_off = set()
+        batch_size = config.DETECT_BATCH_SIZE if batch_size is None else batch_size
+        batch_timeout = config.DETECT_BATCH_TIMEOUT if batch_timeout is None else batch_timeout
+        super().__init__(input_queue, stop_event, name, batch_size=batch_size, batch_timeout=batch_timeout)
 
     def load_model(self):
-        self.nn = cv2.dnn.readNetFromDarknet(config.DETECT_CFG_PATH, config.DETECT_WEIGHTS_PATH)
-        self.nn.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
-        self.nn.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
-        self.layer_names = self.nn.getLayerNames()
-        self.output_layers = [self.layer_names[i - 1] for i in self.nn.getUnconnectedOutLayers()]
+        model = MODELS.darknet(config.DETECT_CFG_PATH, config.DETECT_WEIGHTS_PATH)
+        self.nn = model.net
+        self.output_layers = model.output_layers
+        if self.cascade:
+            # Time the full resolution pass the cascade stands in for once, so the report can compare real numbers.
+            # Forward cost only depends on the input size, so a blank image will do. First run is warm-up.
+            blank = np.zeros((config.CASCADE_FULL_INPUT, config.CASCADE_FULL_INPUT, 3), dtype=np.uint8)
+            self.forward([blank], config.CASCADE_FULL_INPUT)
+            start = time.perf_counter()
+            self.forward([blank], config.CASCADE_FULL_INPUT)
+            self.full_pass_time = time.perf_counter() - start
+
+    def run(self):
+        super().run()
+        # Drops are only counted while running (a print per drop would stall the pipeline when it's overloaded).
+        if self.faces_dropped:
+            print(f"[{self.name}] {self.faces_dropped} of {self.faces_emitted + self.faces_dropped} faces dropped by a full face queue")
+        self.report_batch_stats()
+        if self.cascade:
+            self.report_cascade_stats()
 
     def process_frame(self, payload):
-        frame = payload["frame"]
-        frame_id = payload["frame_id"]
-        timestamp = payload["timestamp"]
+        self.process_batch([payload])
+
+    def get_frame(self, payload):
+        if "slot" in payload:
+            return self.frame_ring.view(payload["slot"])
+        return payload["frame"]
+
+    def process_batch(self, payloads):
+        # Tracking mode: frames the store says don't need detection skip the net and go straight on with boxes=None.
+        if self.track_store is not None:
+            keyframes = []
+            for payload in payloads:
+                if self.track_store.needs_detection(payload["frame_id"]):
+                    keyframes.append(payload)
+                else:
+                    self.emit_detections(payload, None)
+            payloads = keyframes
+            if not payloads:
+                return
+
+        start = time.time()
+        # Payloads emit_detections has already dealt with (forwarded to the TrackWorker, which now owns the slot,
+        # or dropped and released), by id(). If a later frame of the batch raises, only the rest get released here.
+        self.handed_off = set()
+        try:
+            frames = [self.get_frame(payload) for payload in payloads]
+            if self.cascade:
+                self.detect_cascade(payloads, frames)
+            else:
+                per_frame = self.forward(frames, config.DETECT_INPUT_SIZE)
+                for payload, frame, frame_outputs in zip(payloads, frames, per_frame):
+                    self.handle_detections(payload, frame, frame_outputs)
+        finally:
+            for payload in payloads:
+                if "slot" in payload and id(payload) not in self.handed_off:
+                    self.frame_ring.release(payload["slot"])
 
+        done = time.time()
+        stats = self.batch_stats.setdefault(len(payloads), [0, 0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += len(payloads)
+        stats[2] += done - start
+        stats[3] += sum(done - payload["timestamp"] for payload in payloads)
+        per_frame_time = (done - start) / len(payloads)
+        if self.service_time == 0.0:
+            self.service_time = per_frame_time
+        else:
+            self.service_time += 0.2 * (per_frame_time - self.service_time)
+
+    def forward(self, images, size):
+        """
+        One forward pass over images, all resized to size x size. Returns the output layers split per image.
+        """
+        with metrics.timer("stage_seconds", stage="blob_prep"):
+            blob = cv2.dnn.blobFromImages(images, 1/255.0, (size, size), swapRB=True, crop=False)
+        with metrics.timer("stage_seconds", stage="forward"):
+            self.nn.setInput(blob)
+            outputs = self.nn.forward(self.output_layers)
+        # A batch of one comes back as (rows, 7) per output layer, bigger batches as (batch, rows, 7).
+        if len(images) == 1:
+            return [outputs]
+        return [[output[i] for output in outputs] for i in range(len(images))]
+
+    def detect_cascade(self, payloads, frames):
+        """
+        Stage one runs the whole frame through the net at CASCADE_BODY_INPUT and keeps both bodies and any faces
+        already big enough to show up. Stage two cuts the top of each body out (see cascade.body_rois), upscales
+        the crops to CASCADE_FACE_INPUT and runs them all through one batched pass looking for faces. Frames with
+        no bodies never get a second pass.
+        """
+        start = time.perf_counter()
+        with metrics.timer("stage_seconds", stage="body_pass"):
+            body_outputs = self.forward(frames, config.CASCADE_BODY_INPUT)
+
+        found = []  # per frame: lists of face boxes and confidences
+        roi_images, roi_boxes, roi_owners = [], [], []
+        with metrics.timer("stage_seconds", stage="decode"):
+            for i, (frame, outputs) in enumerate(zip(frames, body_outputs)):
+                height, width = frame.shape[:2]
+                boxes, confidences, class_ids = yolo_decode.decode_detections(outputs, width, height,
+                                                                              config.CONFIDENCE_THRESHOLD)
+                is_face = class_ids == config.FACE_CLASS_ID
+                found.append(([boxes[is_face]], [confidences[is_face]]))
+                is_body = class_ids == config.BODY_CLASS_ID
+                bodies, body_confidences = boxes[is_body], confidences[is_body]
+                if config.DETECT_NMS_THRESHOLD is not None:
+                    keep = yolo_decode.apply_nms(bodies, body_confidences, config.CONFIDENCE_THRESHOLD,
+                                                 config.DETECT_NMS_THRESHOLD)
+                    bodies, body_confidences = bodies[keep], body_confidences[keep]
+                for x, y, w, h in cascade.body_rois(bodies, body_confidences, width, height, config.CASCADE_ROI_TOP,
+                                                    config.CASCADE_ROI_PADDING, config.CASCADE_MAX_ROIS):
+                    roi_images.append(frame[y:y+h, x:x+w])
+                    roi_boxes.append((x, y, w, h))
+                    roi_owners.append(i)
+
+        if roi_images:
+            with metrics.timer("stage_seconds", stage="face_pass"):
+                face_outputs = self.forward(roi_images, config.CASCADE_FACE_INPUT)
+            with metrics.timer("stage_seconds", stage="decode"):
+                for roi, owner, outputs in zip(roi_boxes, roi_owners, face_outputs):
+                    boxes, confidences, _ = yolo_decode.decode_detections(outputs, roi[2], roi[3],
+                                                                          config.CONFIDENCE_THRESHOLD,
+                                                                          class_id=config.FACE_CLASS_ID)
+                    found[owner][0].append(cascade.to_frame_coords(boxes, roi))
+                    found[owner][1].append(confidences)
+
+        for payload, frame, (box_lists, confidence_lists) in zip(payloads, frames, found):
+            boxes = np.concatenate(box_lists).astype(np.int64)
+            confidences = np.concatenate(confidence_lists)
+            # Overlapping ROIs (and faces the first pass already caught) find the same face more than once.
+            if config.DETECT_NMS_THRESHOLD is not None:
+                boxes = boxes[yolo_decode.apply_nms(boxes, confidences, config.CONFIDENCE_THRESHOLD,
+                                                    config.DETECT_NMS_THRESHOLD)]
+            self.handle_boxes(payload, frame, boxes)
+
+        stats = self.cascade_stats
+        pixels = cascade.input_pixels(config.CASCADE_BODY_INPUT, config.CASCADE_FACE_INPUT, len(frames), len(roi_images))
+        stats[0] += len(frames)
+        stats[1] += len(roi_images)
+        stats[2] += pixels
+        stats[3] += time.perf_counter() - start
+        metrics.inc("cascade_rois_total", len(roi_images))
+        metrics.inc("detect_input_pixels_total", pixels, mode="cascade")
+        metrics.inc("detect_input_pixels_total", len(frames) * config.CASCADE_FULL_INPUT ** 2, mode="full_equivalent")
+
+    def handle_detections(self, payload, frame, outputs):
         height, width = frame.shape[:2]
-        blob = cv2.dnn.blobFromImage(frame, 1/255.0, (416, 416), swapRB=True, crop=False)
-        self.nn.setInput(blob)
-        outputs = self.nn.forward(self.output_layers)
-
-        for output in outputs:
-            for detection in output:
-                scores = detection[5:]
-                class_id = int(np.argmax(scores))
-                confidence = scores[class_id]
-                if confidence > 0.5:
-                    center_x = int(detection[0] * width)
-                    center_y = int(detection[1] * height)
-                    w = int(detection[2] * width)
-                    h = int(detection[3] * height)
-                    x = max(0, int(center_x - w / 2))
-                    y = max(0, int(center_y - h / 2))
-                    w = min(w, width - x)
-                    h = min(h, height - y)
-
-                    if class_id == 1:  # face class
-                        face_crop = frame[y:y+h, x:x+w]
-                        if face_crop.size == 0:
-                            continue
-                        face_resized = cv2.resize(face_crop, (150, 150))
-
-                        try:
-                            self.face_output_queue.put_nowait({
-                                "frame_id": frame_id,
-                                "timestamp": timestamp,
-                                "face": face_resized,
-                            })
-                        except:
-                            print(f"[{self.name}] Warning: face queue full, face dropped.")
+
+        with metrics.timer("stage_seconds", stage="decode"):
+            boxes, _, _ = yolo_decode.decode(outputs, width, height, config.CONFIDENCE_THRESHOLD,
+                                             class_id=config.FACE_CLASS_ID, nms_threshold=config.DETECT_NMS_THRESHOLD)
+        self.handle_boxes(payload, frame, boxes)
+
+    def handle_boxes(self, payload, frame, boxes):
+        metrics.inc("faces_detected_total", len(boxes))
+        if self.track_store is not None:
+            self.emit_detections(payload, boxes)
+            return
+
+        # Boxes go to the sink (if any) before the crops, never blocking: a sink that's behind just loses the event.
+        publish(self.sink_queue, {
+            "frame_id": payload["frame_id"],
+            "source_id": payload.get("source_id"),
+            "timestamp": payload["timestamp"],
+            "boxes": [tuple(int(v) for v in box) for box in boxes],
+        })
+
+        faces = []
+        face_boxes = []
+        with metrics.timer("stage_seconds", stage="crop_resize"):
+            for x, y, w, h in boxes:
+                face_crop = frame[y:y+h, x:x+w]
+                if face_crop.size == 0:
+                    continue
+                faces.append(cv2.resize(face_crop, (150, 150)))
+                face_boxes.append((int(x), int(y), int(w), int(h)))
+        self.emit_faces(payload, faces, face_boxes)
+
+    def emit_faces(self, payload, faces, boxes):
+        for face, box in zip(faces, boxes):
+            try:
+                self.face_output_queue.put_nowait({
+                    "frame_id": payload["frame_id"],
+                    "timestamp": payload["timestamp"],
+                    "source_id": payload.get("source_id"),
+                    "box": box,
+                    "face": face,
+                    "enqueued_at": time.time(),
+                })
+                self.faces_emitted += 1
+            except Full:
+                self.faces_dropped += 1
+                metrics.inc("dropped_total", where="face_queue")
+
+    def emit_detections(self, payload, boxes):
+        # Forwards the whole frame to the TrackWorker, which from here on owns it (and releases its ring slot).
+        self.handed_off.add(id(payload))
+        try:
+            self.face_output_queue.put_nowait(dict(payload, boxes=boxes, enqueued_at=time.time()))
+        except Full:
+            if "slot" in payload:
+                self.frame_ring.release(payload["slot"])
+            metrics.inc("dropped_total", where="track_queue")
+
+    def report_batch_stats(self):
+        # Busy fps is frames per second of forward+decode time; latency is capture to crops-queued, so it includes
+        # the time spent waiting in detect_queue and for the batch to fill.
+        for size in sorted(self.batch_stats):
+            batches, frames, busy, latency = self.batch_stats[size]
+            fps = frames / busy if busy > 0 else 0.0
+            print(f"[{self.name}] batch={size}: {batches} batches, {frames} frames, "
+                  f"{fps:.1f} fps busy throughput, {1000 * latency / frames:.1f} ms mean latency")
+
+    def report_cascade_stats(self):
+        # Input pixels and forward time the cascade spent, against one full-frame pass at CASCADE_FULL_INPUT.
+        frames, rois, pixels, seconds = self.cascade_stats
+        if not frames:
+            return
+        full = config.CASCADE_FULL_INPUT
+        pixel_share = pixels / (frames * full * full)
+        print(f"[{self.name}] cascade: {frames} frames, {rois / frames:.1f} ROIs/frame, "
+              f"{100 * pixel_share:.0f}% of the input pixels of a {full}x{full} pass ({100 * (1 - pixel_share):.0f}% saved)")
+        if self.full_pass_time:
+            time_share = seconds / frames / self.full_pass_time
+            print(f"[{self.name}] cascade: {1000 * seconds / frames:.1f} ms/frame vs {1000 * self.full_pass_time:.1f} ms "
+                  f"for a {full}x{full} pass ({100 * (1 - time_share):.0f}% saved)")
 
 
 class FaceWorker(WorkerBase):
-    def process_frame(self, payload):
-        frame_id = payload["frame_id"]
-        timestamp = payload["timestamp"]
-        print(f"[{self.name}] Processing frame {frame_id} (timestamp {timestamp:.2f}) for face recognition.")
+    """
+    Live recognizer. Predicts each face crop against the LBPH model at config.TARGET_FACE_PATH and sends
+    {"frame_id", "source_id", "timestamp", "box", "label", "distance", "match"} on to result_queue (e.g. a
+    ResultSink's events queue). Without a result_queue matches are printed here.
+    """
+    def __init__(self, input_queue, stop_event, name="FaceWorker", result_queue=None, model_path=None,
+                 batch_size=None, batch_timeout=None, track_store=None, reload_interval=None):
+        self.result_queue = result_queue
+        self.track_store = track_store
+        self.model_path = model_path or config.TARGET_FACE_PATH
+        self.reload_interval = config.RECOG_RELOAD_INTERVAL if reload_interval is None else reload_interval
+        self.next_reload_check = time.monotonic() + (self.reload_interval or 0)
+        self.reloading = False
+        self.faces_seen = 0
+        self.predict_time = 0.0
+        self.result_latency = 0.0
+        batch_size = config.FACE_BATCH_SIZE if batch_size is None else batch_size
+        batch_timeout = config.FACE_BATCH_TIMEOUT if batch_timeout is None else batch_timeout
+        super().__init__(input_queue, stop_event, name, batch_size=batch_size, batch_timeout=batch_timeout)
 
     def load_model(self):
-        pass
+        self.recognizer = None
+        # Crops arrive as 150x150 BGR, so one grayscale buffer gets reused for every face.
+        self.gray = np.empty((150, 150), dtype=np.uint8)
+        self.model_stamp = self._model_stamp()
+        if self.model_stamp is None:
+            print(f"[{self.name}] Warning: no trained model at {self.model_path}, faces will not be recognized.")
+            return
+        self.recognizer = MODELS.lbph(self.model_path)
+
+    def _model_stamp(self):
+        try:
+            st = os.stat(self.model_path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _maybe_reload(self):
+        # Picks up a newer model file (e.g. from `targetter --update`) without stopping the pipeline. One stat() every
+        # reload_interval seconds on the worker itself; reading a changed model (which for a big target set takes a
+        # while) happens on a helper thread, and predictions carry on with the old one meanwhile.
+        if not self.reload_interval or self.reloading or time.monotonic() < self.next_reload_check:
+            return
+        self.next_reload_check = time.monotonic() + self.reload_interval
+        stamp = self._model_stamp()
+        if stamp is None or stamp == self.model_stamp:
+            return
+        self.reloading = True
+        threading.Thread(target=self._reload, args=(stamp,), daemon=True, name=f"{self.name}-reload").start()
+
+    def _reload(self, stamp):
+        try:
+            recognizer = MODELS.lbph(self.model_path)
+        except cv2.error as e:
+            print(f"[{self.name}] Warning: could not reload {self.model_path}, keeping the current model: {e}")
+        else:
+            # A single attribute swap; the batch in progress finishes on the model it started with.
+            self.recognizer = recognizer
+            metrics.inc("model_reloads_total")
+            print(f"[{self.name}] Reloaded updated model from {self.model_path}")
+        finally:
+            self.model_stamp = stamp
+            self.reloading = False
+
+    def run(self):
+        super().run()
+        if self.faces_seen:
+            print(f"[{self.name}] {self.faces_seen} faces, {1000 * self.predict_time / self.faces_seen:.2f} ms/face predict, "
+                  f"{1000 * self.result_latency / self.faces_seen:.1f} ms mean capture-to-result latency")
+
+    def process_batch(self, payloads):
+        self._maybe_reload()
+        recognizer = self.recognizer
+        if recognizer is None:
+            return
+        start = time.time()
+        results = []
+        for payload in payloads:
+            face = payload["face"]
+            if face.shape[:2] == self.gray.shape:
+                gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY, dst=self.gray)
+            else:
+                gray = cv2.resize(cv2.cvtColor(face, cv2.COLOR_BGR2GRAY), (150, 150))
+            with metrics.timer("stage_seconds", stage="recognition"):
+                label, distance = recognizer.predict(gray)
+            result = {
+                "frame_id": payload["frame_id"],
+                "source_id": payload.get("source_id"),
+                "timestamp": payload["timestamp"],
+                "box": payload.get("box"),
+                "label": label,
+                "distance": distance,
+                "match": distance <= config.RECOG_DISTANCE_THRESHOLD,
+            }
+            if "track_id" in payload:
+                # Came through a TrackWorker: cache the result on the track so it isn't asked again for a while.
+                result["track_id"] = payload["track_id"]
+                if self.track_store is not None:
+                    self.track_store.record_recognition(payload["track_id"], label, distance, result["match"])
+            results.append(result)
+        done = time.time()
+
+        self.faces_seen += len(payloads)
+        self.predict_time += done - start
+        self.result_latency += sum(done - payload["timestamp"] for payload in payloads)
+
+        for result in results:
+            if result["match"]:
+                metrics.inc("matches_total", source=result["source_id"])
+            if self.result_queue is not None:
+                publish(self.result_queue, result)
+            elif result["match"]:
+                where = f"Frame {result['frame_id']}" if result["source_id"] is None else \
+                    f"Camera {result['source_id']} frame {result['frame_id']}"
+                print(f"[{self.name}] {where}: target match (distance {result['distance']:.1f})")
+
+    def process_frame(self, payload):
+        self.process_batch([payload])
@@ -0,0 +1,61 @@
+# yolo_decode.py
+# Shared Darknet/YOLO output decoding for the live DetectWorker and the still-image FacePackager.
+# Works on the whole output array at once instead of looping over rows in Python.
+
+import cv2
+import numpy as np
+
+
+def decode_detections(outputs, width, height, confidence_threshold=0.5, class_id=None):
+    """
+    Turns the raw output layers of one image into pixel boxes.
+    outputs is the list returned by net.forward(output_layers) for a single image, each of shape (rows, 5 + classes).
+    Returns (boxes, confidences, class_ids) where boxes is an (N, 4) int array of [x, y, w, h] clipped to the image.
+    If class_id is given only detections of that class are kept.
+    """
+    rows = np.concatenate([np.asarray(output).reshape(-1, output.shape[-1]) for output in outputs])
+    scores = rows[:, 5:]
+    class_ids = scores.argmax(axis=1)
+    confidences = scores[np.arange(len(rows)), class_ids]
+
+    keep = (confidences >= confidence_threshold) & np.isfinite(rows[:, :4]).all(axis=1)
+    if class_id is not None:
+        keep &= class_ids == class_id
+    rows = rows[keep]
+    confidences = confidences[keep].astype(np.float32)
+    class_ids = class_ids[keep]
+
+    # Same truncating int math as the old per-row loops, just done column-wise.
+    center_x = (rows[:, 0] * width).astype(np.int64)
+    center_y = (rows[:, 1] * height).astype(np.int64)
+    w = (rows[:, 2] * width).astype(np.int64)
+    h = (rows[:, 3] * height).astype(np.int64)
+    x = np.maximum(0, (center_x - w / 2).astype(np.int64))
+    y = np.maximum(0, (center_y - h / 2).astype(np.int64))
+    w = np.minimum(w, width - x)
+    h = np.minimum(h, height - y)
+
+    boxes = np.stack([x, y, w, h], axis=1)
+    valid = (boxes[:, 2] > 0) & (boxes[:, 3] > 0)
+    return boxes[valid], confidences[valid], class_ids[valid]
+
+
+def apply_nms(boxes, confidences, confidence_threshold=0.5, nms_threshold=0.3):
+    """
+    Non-maximum suppression over decoded boxes. Returns a flat int array of indices to keep.
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    indices = cv2.dnn.NMSBoxes(boxes.tolist(), confidences.tolist(), confidence_threshold, nms_threshold)
+    return np.asarray(indices, dtype=np.int64).reshape(-1)
+
+
+def decode(outputs, width, height, confidence_threshold=0.5, class_id=None, nms_threshold=None):
+    """
+    decode_detections followed by NMS. Pass nms_threshold=None to keep every overlapping detection.
+    """
+    boxes, confidences, class_ids = decode_detections(outputs, width, height, confidence_threshold, class_id)
+    if nms_threshold is not None:
+        keep = apply_nms(boxes, confidences, confidence_threshold, nms_threshold)
+        boxes, confidences, class_ids = boxes[keep], confidences[keep], class_ids[keep]
+    return boxes, confidences, class_ids